@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
 import plotly.express as px
 
+from allocation import STRATEGIES, allocate, strategy_weights
+from data_store import ensure_data_loaded
+from maps import choropleth
+from metrics import update_allocation_results
+from profiling import begin_rerun, render_panel, stage
+
 st.set_page_config(layout="wide", page_title="Dashboard - Insurance Pricing")
 
 METRIC_COLUMNS = {
@@ -12,28 +17,53 @@ METRIC_COLUMNS = {
     "Census": "index"
 }
 
-if "data" not in st.session_state or "customers" not in st.session_state:
-    map_df = gpd.read_file("./arrondissements_municipaux/arrondissements_municipaux-20180711.shp")
-    map_df = map_df[map_df['insee'].isin(['75101','75102','75103','75104','75105','75106',
-                '75107','75108','75109','75110','75111','75112','75113',
-                '75114','75115','75116','75117','75118','75119','75120'])]
-    
 
-    city_exposure = pd.read_csv("city_exposure.csv")
-    city_exposure["COM"] = city_exposure["COM"].astype(str)
 
-    customers = pd.read_csv("customers.csv")
-    customers["COM"] = customers["COM"].astype(str)  # Ensure COM is string for matching
-    st.session_state.customers = customers
-    
-    filosofi_filtered = pd.read_csv("filosofi_filtered.csv")
-    filosofi_filtered["insee"] = filosofi_filtered["COM"].astype(str)
-    filosofi_filtered = filosofi_filtered.drop(columns=["COM"])
+# The tables below only depend on the data, so they are built once per data version
+@st.cache_data(max_entries=4)
+def summary_table(version, _data):
+    summary_data = _data.groupby(['insee', 'nom']).agg({
+        'patrimoine': 'sum',
+        'model_premium': 'mean',
+        'DISP_MED18': 'mean',
+        'index': 'sum'
+    }).reset_index()
+    summary_data.columns = ['Arrondissement Code', 'Arrondissement', 'Ensured Amount',
+                            'Model Premium', 'Median Revenues', 'Census']
+    return summary_data.round(2)
+
+
+@st.cache_data(max_entries=4)
+def customer_distribution(version, _arr_index):
+    customer_dist = pd.DataFrame({
+        'Arrondissement': _arr_index.index,
+        'Number of Customers': _arr_index['customers'].to_numpy(),
+        'Total Ensured Amount': _arr_index['patrimoine'].to_numpy(),
+        'Avg Ensured Amount': (_arr_index['patrimoine'] / _arr_index['customers']).to_numpy(),
+        'Avg Premium': (_arr_index['model_premium'] / _arr_index['customers']).to_numpy(),
+    })
+    return customer_dist.sort_values('Number of Customers', ascending=False)
 
-    map_data = map_df.merge(city_exposure, left_on="insee", right_on="COM", how="left")
-    map_data = map_data.merge(filosofi_filtered, on="insee", how="left")
 
-    st.session_state.data = map_data
+def cached_figure(name, inputs, build):
+    """Figure ``name``, rebuilt by ``build()`` only when ``inputs`` differ from the previous rerun's."""
+    figures = st.session_state.setdefault("dashboard_figures", {})
+    entry = figures.get(name)
+    if entry is None or entry[0] != inputs:
+        figures[name] = (inputs, build())
+    return figures[name][1]
+
+
+begin_rerun("Dashboard")
+
+with stage("load data"):
+    shared = ensure_data_loaded()
+version = st.session_state.data_version
+# Per-arrondissement counts and sums, built once per data version
+arr_index = shared["arr_index"]
+# Simplified arrondissement polygons, serialized once per process and shared by every map
+geojson = shared["geojson"]
+num_customers = int(arr_index['customers'].sum())
 
 
 st.title("Insurance Policy Increase")
@@ -52,45 +82,35 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Selected Metrics by Arrondissement")
-    # Create a summary table with metrics by arrondissement
-    summary_data = st.session_state.data.groupby(['insee', 'nom']).agg({
-        'patrimoine': 'sum',
-        'model_premium': 'mean',
-        'DISP_MED18': 'mean',
-        'index': 'sum'
-    }).reset_index()
-    summary_data.columns = ['Arrondissement Code', 'Arrondissement', 'Ensured Amount', 
-                           'Model Premium', 'Median Revenues', 'Census']
-    summary_data = summary_data.round(2)
-    st.dataframe(summary_data, use_container_width=True, hide_index=True)
+    with stage("summary table"):
+        st.dataframe(summary_table(version, st.session_state.data), use_container_width=True, hide_index=True)
 
 with col2:
     st.subheader("Map Visualization")
-    fig = px.choropleth(st.session_state.data, geojson=st.session_state.data.geometry, 
-                       locations=st.session_state.data.index, 
-                       color=METRIC_COLUMNS[metric], 
-                       projection="mercator",
-                       labels={METRIC_COLUMNS[metric]: metric})
-    fig.update_geos(fitbounds="locations", visible=True)
-    st.plotly_chart(fig, use_container_width=True)
+    with stage("metric map"):
+        fig = cached_figure("metric map", (version, metric), lambda: choropleth(
+            st.session_state.data.drop(columns='geometry'), geojson,
+            color=METRIC_COLUMNS[metric],
+            labels={METRIC_COLUMNS[metric]: metric}))
+        st.plotly_chart(fig, use_container_width=True)
 
 # Customer characteristics section
 st.subheader("Customer Characteristics")
 customer_cols = st.columns(4)
 
 with customer_cols[0]:
-    st.metric("Total Customers", f"{len(st.session_state.customers):,}")
+    st.metric("Total Customers", f"{num_customers:,}")
 
 with customer_cols[1]:
-    avg_patrimoine = st.session_state.customers['patrimoine'].mean()
+    avg_patrimoine = arr_index['patrimoine'].sum() / num_customers
     st.metric("Average Ensured Amount", f"€{avg_patrimoine:,.2f}")
 
 with customer_cols[2]:
-    avg_premium = st.session_state.customers['model_premium'].mean()
+    avg_premium = arr_index['model_premium'].sum() / num_customers
     st.metric("Average Model Premium", f"€{avg_premium:,.2f}")
 
 with customer_cols[3]:
-    total_patrimoine = st.session_state.customers['patrimoine'].sum()
+    total_patrimoine = arr_index['patrimoine'].sum()
     st.metric("Total Ensured Amount", f"€{total_patrimoine:,.0f}")
 
 # Portfolio metrics section
@@ -98,9 +118,9 @@ st.subheader("Portfolio Metrics")
 portfolio_cols = st.columns(4)
 
 # Calculate portfolio-level metrics
-total_expected_loss = (st.session_state.customers['patrimoine'] * st.session_state.customers['prob']).sum()
-total_premium = st.session_state.customers['model_premium'].sum()
-avg_prob = st.session_state.customers['prob'].mean()
+total_expected_loss = arr_index['expected_loss'].sum()
+total_premium = arr_index['model_premium'].sum()
+avg_prob = arr_index['prob'].sum() / num_customers
 total_census = st.session_state.data['index'].sum() if 'index' in st.session_state.data.columns else 0
 
 with portfolio_cols[0]:
@@ -117,15 +137,8 @@ with portfolio_cols[3]:
 
 # Additional customer distribution by arrondissement
 st.subheader("Customer Distribution by Arrondissement")
-if 'COM' in st.session_state.customers.columns:
-    customer_dist = st.session_state.customers.groupby('COM').agg({
-        'patrimoine': ['count', 'sum', 'mean'],
-        'model_premium': 'mean'
-    }).reset_index()
-    customer_dist.columns = ['Arrondissement', 'Number of Customers', 'Total Ensured Amount', 
-                            'Avg Ensured Amount', 'Avg Premium']
-    customer_dist = customer_dist.sort_values('Number of Customers', ascending=False)
-    st.dataframe(customer_dist, use_container_width=True, hide_index=True)
+if len(arr_index) > 0:
+    st.dataframe(customer_distribution(version, arr_index), use_container_width=True, hide_index=True)
 
 # Pricing Allocation Section
 st.markdown("---")
@@ -137,6 +150,8 @@ arrondissements = st.session_state.data.groupby(['insee', 'nom']).first().reset_
 arrondissements['insee'] = arrondissements['insee'].astype(str)
 arrondissements_list = arrondissements['insee'].tolist()
 arrondissements_names = dict(zip(arrondissements['insee'], arrondissements['nom']))
+# Map attributes (census, incomes...) by arrondissement code, used by the allocation strategies
+arr_data = st.session_state.data.drop(columns='geometry').groupby('insee').first()
 
 # Target display (fixed, not modifiable)
 target = st.session_state.target_profit_costs  # Fixed at 2 million euros
@@ -153,57 +168,34 @@ with col_target1:
 with col_target2:
     st.write("")
     st.write("")
-    current_total_premium = st.session_state.customers['model_premium'].sum()
-    current_expected_loss = (st.session_state.customers['patrimoine'] * st.session_state.customers['prob']).sum()
+    current_total_premium = total_premium
+    current_expected_loss = total_expected_loss
     current_profit = current_total_premium - current_expected_loss
     st.metric("Current Profit", f"€{current_profit:,.2f}")
 
 # Allocation method selection
 allocation_method = st.radio(
     "Allocation Method",
-    ["Manual Entry", "Proportional to Exposure", "Proportional to Risk", "Equal Distribution"],
+    ["Manual Entry"] + list(STRATEGIES),
     horizontal=True
 )
 
-# Calculate allocation based on method
-if allocation_method == "Equal Distribution":
-    num_arr = len(arrondissements_list)
-    equal_amount = target / num_arr if num_arr > 0 else 0
-    for arr in arrondissements_list:
-        st.session_state.allocation_dict[arr] = equal_amount
-    # Display the calculated allocations
-    st.info(f"✅ Allocated equally across {num_arr} arrondissements. Each receives: €{equal_amount:,.2f}")
-elif allocation_method == "Proportional to Exposure":
-    # Calculate total exposure by arrondissement
-    exposure_by_arr = st.session_state.customers.groupby('COM').agg({'patrimoine': 'sum'}).reset_index()
-    total_exposure = exposure_by_arr['patrimoine'].sum()
-    if total_exposure > 0:
-        for arr in arrondissements_list:
-            arr_str = str(arr)
-            exposure_match = exposure_by_arr[exposure_by_arr['COM'].astype(str) == arr_str]['patrimoine']
-            exposure = exposure_match.values[0] if len(exposure_match) > 0 else 0
-            st.session_state.allocation_dict[arr] = (exposure / total_exposure) * target
-    else:
-        for arr in arrondissements_list:
-            st.session_state.allocation_dict[arr] = 0
+# Calculate allocation based on method (one vectorized step over all arrondissements)
+if allocation_method != "Manual Entry":
+    with stage("allocation strategy"):
+        weights = strategy_weights(allocation_method, arr_index, arr_data, arrondissements_list)
+        st.session_state.allocation_dict.update(allocate(weights, target).to_dict())
     # Display the calculated allocations
-    st.info(f"✅ Allocated proportionally based on insured amounts (exposure). Total exposure: €{total_exposure:,.2f}")
-elif allocation_method == "Proportional to Risk":
-    # Calculate total expected loss by arrondissement
-    st.session_state.customers['expected_loss'] = st.session_state.customers['patrimoine'] * st.session_state.customers['prob']
-    risk_by_arr = st.session_state.customers.groupby('COM').agg({'expected_loss': 'sum'}).reset_index()
-    total_risk = risk_by_arr['expected_loss'].sum()
-    if total_risk > 0:
-        for arr in arrondissements_list:
-            arr_str = str(arr)
-            risk_match = risk_by_arr[risk_by_arr['COM'].astype(str) == arr_str]['expected_loss']
-            risk = risk_match.values[0] if len(risk_match) > 0 else 0
-            st.session_state.allocation_dict[arr] = (risk / total_risk) * target
+    if allocation_method == "Equal Distribution":
+        num_arr = len(arrondissements_list)
+        equal_amount = target / num_arr if num_arr > 0 else 0
+        st.info(f"✅ Allocated equally across {num_arr} arrondissements. Each receives: €{equal_amount:,.2f}")
+    elif allocation_method == "Proportional to Exposure":
+        st.info(f"✅ Allocated proportionally based on insured amounts (exposure). Total exposure: €{weights.sum():,.2f}")
+    elif allocation_method == "Proportional to Risk":
+        st.info(f"✅ Allocated proportionally based on expected losses (risk). Total expected loss: €{weights.sum():,.2f}")
     else:
-        for arr in arrondissements_list:
-            st.session_state.allocation_dict[arr] = 0
-    # Display the calculated allocations
-    st.info(f"✅ Allocated proportionally based on expected losses (risk). Total expected loss: €{total_risk:,.2f}")
+        st.info(f"✅ Allocated {allocation_method.lower()}. Total weight: {weights.sum():,.2f}")
 
 # Display calculated allocations in a table for all methods
 if allocation_method != "Manual Entry":
@@ -223,24 +215,25 @@ if allocation_method != "Manual Entry":
 if allocation_method == "Manual Entry" or st.checkbox("Adjust allocations manually"):
     st.subheader("Allocate Target Across Arrondissements")
     
-    # Create columns for input
-    num_cols = 4
-    cols = st.columns(num_cols)
+    with stage("manual entry"):
+        # Create columns for input
+        num_cols = 4
+        cols = st.columns(num_cols)
     
-    for idx, arr in enumerate(arrondissements_list):
-        col_idx = idx % num_cols
-        with cols[col_idx]:
-            arr_name = arrondissements_names.get(arr, f"Arr {arr}")
-            current_val = st.session_state.allocation_dict.get(arr, 0.0)
-            new_val = st.number_input(
-                f"{arr_name} ({arr})",
-                min_value=0.0,
-                value=float(current_val),
-                step=1000.0,
-                format="%.2f",
-                key=f"alloc_{arr}"
-            )
-            st.session_state.allocation_dict[arr] = new_val
+        for idx, arr in enumerate(arrondissements_list):
+            col_idx = idx % num_cols
+            with cols[col_idx]:
+                arr_name = arrondissements_names.get(arr, f"Arr {arr}")
+                current_val = st.session_state.allocation_dict.get(arr, 0.0)
+                new_val = st.number_input(
+                    f"{arr_name} ({arr})",
+                    min_value=0.0,
+                    value=float(current_val),
+                    step=1000.0,
+                    format="%.2f",
+                    key=f"alloc_{arr}"
+                )
+                st.session_state.allocation_dict[arr] = new_val
 
 # Calculate total allocation
 total_allocated = sum(st.session_state.allocation_dict.values())
@@ -264,55 +257,27 @@ if total_allocated > 0:
     st.markdown("---")
     st.header("📊 Resulting Metrics After Allocation")
     
-    # Calculate metrics by arrondissement
-    results_list = []
-    total_new_premium = 0
-    total_expected_loss_portfolio = 0
-    
-    for arr in arrondissements_list:
-        arr_str = str(arr)
-        arr_customers = st.session_state.customers[st.session_state.customers['COM'].astype(str) == arr_str]
-        
-        if len(arr_customers) > 0:
-            arr_expected_loss = (arr_customers['patrimoine'] * arr_customers['prob']).sum()
-            arr_current_premium = arr_customers['model_premium'].sum()
-            arr_avg_current_premium = arr_customers['model_premium'].mean()
-            arr_allocation = st.session_state.allocation_dict.get(arr, 0.0)
-            
-            # Calculate new premium: current premium + allocation
-            arr_new_premium = arr_current_premium + arr_allocation
-            # Calculate average new premium: average current premium + (allocation / number of customers)
-            arr_avg_new_premium = arr_avg_current_premium + (arr_allocation / len(arr_customers)) if len(arr_customers) > 0 else arr_avg_current_premium
-            arr_profit = arr_new_premium - arr_expected_loss
-            arr_profit_margin = (arr_profit / arr_new_premium * 100) if arr_new_premium > 0 else 0
-            
-            total_new_premium += arr_new_premium
-            total_expected_loss_portfolio += arr_expected_loss
-            
-            results_list.append({
-                'Arrondissement Code': arr,
-                'Arrondissement': arrondissements_names.get(arr, f"Arr {arr}"),
-                'Allocation (€)': arr_allocation,
-                'Current Premium (€)': arr_current_premium,
-                'Avg Current Premium (€)': arr_avg_current_premium,
-                'New Premium (€)': arr_new_premium,
-                'Avg New Premium (€)': arr_avg_new_premium,
-                'Expected Loss (€)': arr_expected_loss,
-                'Profit (€)': arr_profit,
-                'Profit Margin (%)': arr_profit_margin,
-                'Customers': len(arr_customers)
-            })
-    
-    results_df = pd.DataFrame(results_list)
+    with stage("results table"):
+        # Metrics by arrondissement from the precomputed index (no scan of the customer table), kept
+        # across reruns: editing one allocation recomputes that row and shifts the totals by its change
+        allocation_series = pd.Series(
+            [st.session_state.allocation_dict.get(arr, 0.0) for arr in arrondissements_list],
+            index=arrondissements_list,
+        )
+        results_state = st.session_state.setdefault("allocation_results", {})
+        update_allocation_results(results_state, arr_index, allocation_series, arrondissements_names, version)
+        results_df = results_state["results"].reset_index(drop=True)
+        total_new_premium = results_state["totals"]['New Premium (€)']
+        total_expected_loss_portfolio = results_state["totals"]['Expected Loss (€)']
     
-    # Display results table only if we have data
-    if len(results_df) > 0:
-        results_df = results_df.round(2)
-        st.subheader("Metrics by Arrondissement")
-        st.dataframe(results_df, use_container_width=True, hide_index=True)
-    else:
-        st.warning("⚠️ No customer data found for the selected arrondissements. Please check your data.")
-        results_df = pd.DataFrame()  # Ensure it's an empty dataframe with proper structure
+        # Display results table only if we have data
+        if len(results_df) > 0:
+            results_df = results_df.round(2)
+            st.subheader("Metrics by Arrondissement")
+            st.dataframe(results_df, use_container_width=True, hide_index=True)
+        else:
+            st.warning("⚠️ No customer data found for the selected arrondissements. Please check your data.")
+            results_df = pd.DataFrame()  # Ensure it's an empty dataframe with proper structure
     
     # Portfolio-level results
     st.subheader("Portfolio-Level Results")
@@ -335,26 +300,34 @@ if total_allocated > 0:
     
     # Visualization of allocation
     st.subheader("Allocation Visualization")
-    viz_col1, viz_col2 = st.columns(2)
+    with stage("allocation charts"):
+        viz_col1, viz_col2 = st.columns(2)
     
-    with viz_col1:
-        # Bar chart of allocation
-        alloc_df = pd.DataFrame({
-            'Arrondissement': [arrondissements_names.get(arr, f"Arr {arr}") for arr in arrondissements_list],
-            'Allocation (€)': [st.session_state.allocation_dict.get(arr, 0.0) for arr in arrondissements_list]
-        })
-        fig_alloc = px.bar(alloc_df, x='Arrondissement', y='Allocation (€)', 
-                          title="Allocation by Arrondissement")
-        fig_alloc.update_xaxes(tickangle=45)
-        st.plotly_chart(fig_alloc, use_container_width=True)
+        with viz_col1:
+            # Bar chart of allocation
+            def allocation_bar():
+                alloc_df = pd.DataFrame({
+                    'Arrondissement': [arrondissements_names.get(arr, f"Arr {arr}") for arr in arrondissements_list],
+                    'Allocation (€)': allocation_series.to_numpy()
+                })
+                fig_alloc = px.bar(alloc_df, x='Arrondissement', y='Allocation (€)',
+                                  title="Allocation by Arrondissement")
+                fig_alloc.update_xaxes(tickangle=45)
+                return fig_alloc
+            fig_alloc = cached_figure("allocation bar", (version, tuple(allocation_series.round(2).items())), allocation_bar)
+            st.plotly_chart(fig_alloc, use_container_width=True)
     
-    with viz_col2:
-        # Profit margin by arrondissement
-        if len(results_df) > 0:
-            fig_margin = px.bar(results_df, x='Arrondissement', y='Profit Margin (%)',
-                               title="Profit Margin by Arrondissement")
-            fig_margin.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_margin, use_container_width=True)
+        with viz_col2:
+            # Profit margin by arrondissement
+            if len(results_df) > 0:
+                def margin_bar():
+                    fig_margin = px.bar(results_df, x='Arrondissement', y='Profit Margin (%)',
+                                       title="Profit Margin by Arrondissement")
+                    fig_margin.update_xaxes(tickangle=45)
+                    return fig_margin
+                margins = tuple(zip(results_df['Arrondissement'], results_df['Profit Margin (%)']))
+                fig_margin = cached_figure("margin bar", (version, margins), margin_bar)
+                st.plotly_chart(fig_margin, use_container_width=True)
     
     # Map visualization with old and new average premiums
     st.subheader("Map: Average Premiums Comparison")
@@ -363,48 +336,35 @@ if total_allocated > 0:
         'Arrondissement Code' in results_df.columns and 
         'Avg Current Premium (€)' in results_df.columns and
         'Avg New Premium (€)' in results_df.columns):
-        # Merge results with map data
-        map_results = st.session_state.data.copy()
-        
-        # Create mappings for average premiums
-        avg_current_premium_mapping = dict(zip(results_df['Arrondissement Code'], results_df['Avg Current Premium (€)']))
-        avg_new_premium_mapping = dict(zip(results_df['Arrondissement Code'], results_df['Avg New Premium (€)']))
+        with stage("premium maps"):
+            # Each map is rebuilt only when its own premiums change (the current premiums only with the data)
+            current_premiums = tuple(zip(results_df['Arrondissement Code'], results_df['Avg Current Premium (€)']))
+            new_premiums = tuple(zip(results_df['Arrondissement Code'], results_df['Avg New Premium (€)']))
+
+            def premium_map(premiums, column, title, scale):
+                # Merge results with map data; maps use the shared GeoJSON payload
+                map_results = st.session_state.data.drop(columns='geometry')
+                map_results[column] = map_results['insee'].map(dict(premiums)).fillna(0)
+                return choropleth(
+                    map_results,
+                    geojson,
+                    color=column,
+                    labels={column: 'Average Premium (€)'},
+                    title=title,
+                    color_continuous_scale=scale
+                )
+
+            # Create two maps side by side
+            map_col1, map_col2 = st.columns(2)
         
-        map_results['avg_current_premium'] = map_results['insee'].map(avg_current_premium_mapping)
-        map_results['avg_current_premium'] = map_results['avg_current_premium'].fillna(0)
+            with map_col1:
+                fig_map_old = cached_figure("current premium map", (version, current_premiums), lambda: premium_map(
+                    current_premiums, 'avg_current_premium', "Current Average Premiums (Modeled)", "Blues"))
+                st.plotly_chart(fig_map_old, use_container_width=True)
         
-        map_results['avg_new_premium'] = map_results['insee'].map(avg_new_premium_mapping)
-        map_results['avg_new_premium'] = map_results['avg_new_premium'].fillna(0)
-        
-        # Create two maps side by side
-        map_col1, map_col2 = st.columns(2)
-        
-        with map_col1:
-            fig_map_old = px.choropleth(
-                map_results, 
-                geojson=map_results.geometry, 
-                locations=map_results.index, 
-                color='avg_current_premium',
-                projection="mercator",
-                labels={'avg_current_premium': 'Average Premium (€)'},
-                title="Current Average Premiums (Modeled)",
-                color_continuous_scale="Blues"
-            )
-            fig_map_old.update_geos(fitbounds="locations", visible=True)
-            st.plotly_chart(fig_map_old, use_container_width=True)
-        
-        with map_col2:
-            fig_map_new = px.choropleth(
-                map_results, 
-                geojson=map_results.geometry, 
-                locations=map_results.index, 
-                color='avg_new_premium',
-                projection="mercator",
-                labels={'avg_new_premium': 'Average Premium (€)'},
-                title="New Average Premiums (After Allocation)",
-                color_continuous_scale="Greens"
-            )
-            fig_map_new.update_geos(fitbounds="locations", visible=True)
-            st.plotly_chart(fig_map_new, use_container_width=True)
-
+            with map_col2:
+                fig_map_new = cached_figure("new premium map", (version, new_premiums), lambda: premium_map(
+                    new_premiums, 'avg_new_premium', "New Average Premiums (After Allocation)", "Greens"))
+                st.plotly_chart(fig_map_new, use_container_width=True)
 
+render_panel()
@@ -0,0 +1,105 @@
+"""Allocation strategies shared by the Dashboard and the Simulation pages.
+
+A strategy maps the per-arrondissement aggregates to a weight per
+arrondissement; the target is then spread proportionally to those weights in a
+single vectorized step. New strategies are added with ``register_strategy``:
+
+    @register_strategy("Proportional to Something")
+    def something_weights(arr_index, arr_data):
+        return arr_data["something"]
+
+``arr_index`` holds the customer aggregates (see ``metrics.build_arr_index``)
+and ``arr_data`` the map attributes (census, Filosofi incomes...), both indexed
+by arrondissement code and aligned on the same codes.
+
+An arrondissement's amount is then split across its customers evenly or in
+proportion to one of their columns (``SPLIT_MODES``, see ``customer_shares``).
+"""
+import numpy as np
+import pandas as pd
+
+STRATEGIES = {}
+# Customer column an arrondissement's amount is split in proportion to (None: evenly)
+SPLIT_MODES = {
+    "Equal": None,
+    "Patrimoine": "patrimoine",
+    "Expected loss": "expected_loss",
+    "Model premium": "model_premium",
+}
+
+
+def register_strategy(name):
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+@register_strategy("Proportional to Exposure")
+def exposure_weights(arr_index, arr_data):
+    return arr_index["patrimoine"]
+
+
+@register_strategy("Proportional to Risk")
+def risk_weights(arr_index, arr_data):
+    return arr_index["expected_loss"]
+
+
+@register_strategy("Equal Distribution")
+def equal_weights(arr_index, arr_data):
+    return pd.Series(1.0, index=arr_index.index)
+
+
+@register_strategy("Proportional to Customers")
+def customer_count_weights(arr_index, arr_data):
+    return arr_index["customers"]
+
+
+@register_strategy("Proportional to Census")
+def census_weights(arr_index, arr_data):
+    return arr_data["index"]
+
+
+@register_strategy("Proportional to Income")
+def income_weights(arr_index, arr_data):
+    return arr_data["DISP_MED18"]
+
+
+def strategy_weights(name, arr_index, arr_data, codes):
+    """Weights of strategy ``name`` for ``codes``; missing or negative weights count as 0."""
+    weights = STRATEGIES[name](arr_index.reindex(codes), arr_data.reindex(codes))
+    return weights.astype(float).fillna(0.0).clip(lower=0.0)
+
+
+def allocate(weights, target):
+    """Split ``target`` proportionally to ``weights``; all zeros if there is nothing to weight."""
+    total = weights.sum()
+    if total <= 0:
+        return weights * 0.0
+    return weights * (target / total)
+
+
+def customer_shares(codes, n_groups, weights=None):
+    """Fraction of its group's amount each customer receives, in one grouped pass.
+
+    ``codes`` are group codes in ``range(n_groups)``, -1 for customers outside
+    every group (share 0). Shares are proportional to ``weights`` within each
+    group, or equal when ``weights`` is None; a group whose weights sum to zero
+    is split evenly. The shares of each group sum to 1.
+    """
+    # Customers outside the groups go to an extra slot whose total is infinite
+    slots = np.where(codes >= 0, codes, n_groups)
+    counts = np.bincount(slots, minlength=n_groups + 1).astype(np.float64)
+    if weights is None:
+        totals = counts
+    else:
+        weights = np.nan_to_num(np.asarray(weights, dtype=np.float64)).clip(min=0.0)
+        totals = np.bincount(slots, weights=weights, minlength=n_groups + 1)
+        even = totals <= 0
+        if even[:n_groups].any():
+            # Groups without any weight fall back to the even split
+            weights = np.where(even[slots], 1.0, weights)
+            totals = np.where(even, counts, totals)
+    totals[n_groups] = np.inf
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.divide(1.0 if weights is None else weights, totals[slots])
@@ -0,0 +1,219 @@
+"""End-to-end benchmark of the data pipeline, the Dashboard and the churn simulation.
+
+For each portfolio size a synthetic customers file is generated once (see
+generate_customers.py) and every stage is timed with its memory use:
+
+- ingest (cold): customers.csv converted to the columnar cache;
+- load (warm): the cache memory-mapped back, with the expected loss column;
+- dashboard aggregation: the per-arrondissement index;
+- one allocation per strategy, and the results table;
+- churn: probabilities, a single draw, Monte Carlo replications and the exact mode.
+
+Memory is measured two ways. ``peak_rss_mb`` is the highest resident memory
+of the process sampled while the stage runs (from /proc/self/statm), and
+``rss_growth_mb`` its increase over the start of the stage; they include Arrow
+buffers and memory-mapped pages. ``peak_py_alloc_mb`` only counts what
+tracemalloc sees, i.e. Python objects and numpy arrays.
+
+Each run appends one JSON record per stage to the output file (JSON lines)
+with the git revision, so timings can be compared between versions; the
+previous record of the same stage and size is shown next to the new one.
+
+Usage::
+
+    python benchmark.py                          # 10k and 1m
+    python benchmark.py --sizes 10k 1m 10m --replications 200
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import ingest
+import sources
+from allocation import STRATEGIES, allocate, strategy_weights
+from churn import SIM_SEED, analytical_churn, churn_probability, monte_carlo_churn, premium_ratios
+from generate_customers import generate_customers, parse_size
+from metrics import allocation_results, build_arr_index
+from profiling import current_rss
+
+BENCH_DIR = os.path.join(ingest.CACHE_DIR, "bench")
+OUTPUT_PATH = "benchmarks.jsonl"
+DEFAULT_SIZES = ("10k", "1m")
+TARGET = 2_000_000.0
+# Seconds between two resident memory samples during a stage
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def measure(results, stage, **extra):
+    """Time the block and record its peak resident memory and its peak traced allocations."""
+    start_rss = current_rss()
+    peak_rss = [start_rss]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(RSS_SAMPLE_INTERVAL):
+            peak_rss[0] = max(peak_rss[0], current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    tracemalloc.reset_peak()
+    start_current = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] - start_current
+        stop.set()
+        sampler.join()
+        peak_rss[0] = max(peak_rss[0], current_rss())
+    results.append(
+        {
+            "stage": stage,
+            "seconds": seconds,
+            "peak_rss_mb": peak_rss[0] / 2**20,
+            "rss_growth_mb": (peak_rss[0] - start_rss) / 2**20,
+            "peak_py_alloc_mb": peak / 2**20,
+            **extra,
+        }
+    )
+
+
+def portfolio_path(size):
+    """Synthetic customers file for ``size``, generated on first use."""
+    path = os.path.join(BENCH_DIR, f"customers-{size}.csv")
+    if not os.path.exists(path):
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        print(f"Generating {size} portfolio...")
+        generate_customers(parse_size(size), path)
+    return path
+
+
+def run_suite(customers_path, map_data, replications, workers):
+    """Time every stage on one portfolio; returns one result dict per stage."""
+    results = []
+    # A private cache directory per portfolio keeps the app's own cache untouched
+    ingest.CACHE_DIR = os.path.join(BENCH_DIR, "cache-" + os.path.basename(customers_path))
+    shutil.rmtree(ingest.CACHE_DIR, ignore_errors=True)
+
+    with measure(results, "ingest (cold)"):
+        ingest.ingest_customers(customers_path)
+    with measure(results, "load (warm)"):
+        customers = sources.load_customers(customers_path)
+
+    with measure(results, "dashboard aggregation"):
+        arr_index = build_arr_index(customers)
+
+    codes = map_data["insee"].drop_duplicates().sort_values().tolist()
+    arr_data = map_data.drop(columns="geometry").groupby("insee").first()
+    names = dict(zip(map_data["insee"], map_data["nom"]))
+    allocations = {}
+    for name in STRATEGIES:
+        with measure(results, f"allocation: {name}"):
+            allocations[name] = allocate(strategy_weights(name, arr_index, arr_data, codes), TARGET)
+    with measure(results, "results table"):
+        allocation_results(arr_index, allocations["Proportional to Exposure"], names)
+
+    group = pd.Categorical(customers["COM"], categories=codes).codes
+    counts = np.bincount(group[group >= 0], minlength=len(codes))
+    income = arr_data["DISP_MED18"].reindex(codes)
+    income_values = np.append(income.fillna(income.mean()).to_numpy(), income.mean())
+    expected_loss = customers["expected_loss"].to_numpy()
+    with measure(results, "churn: probabilities"):
+        shares = np.zeros(len(codes) + 1)
+        np.divide(allocations["Proportional to Exposure"].to_numpy(), counts, out=shares[:-1], where=counts > 0)
+        new_premium = shares[group] + customers["model_premium"].to_numpy()
+        ratio_income, ratio_patrimoine = premium_ratios(new_premium, income_values[group], customers["patrimoine"].to_numpy())
+        churn_prob = churn_probability(ratio_income, ratio_patrimoine)
+
+    n_groups = len(codes) + 1
+    group_codes = np.where(group >= 0, group, len(codes))
+    with measure(results, "churn: single draw"):
+        stayed = np.random.default_rng(SIM_SEED).random(len(churn_prob)) > churn_prob
+        new_premium[stayed].sum() - expected_loss[stayed].sum(dtype=np.float64)
+    with measure(results, "churn: monte carlo", replications=replications, workers=workers):
+        monte_carlo_churn(churn_prob, group_codes, n_groups, new_premium, expected_loss, replications, workers=workers)
+    with measure(results, "churn: analytical"):
+        analytical_churn(churn_prob, group_codes, n_groups, new_premium, expected_loss, codes + ["other"])
+    return results
+
+
+def previous_records(path):
+    """Last recorded result of every (size, stage) in ``path``."""
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                previous[(record["size"], record["stage"])] = record
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", nargs="+", default=list(DEFAULT_SIZES), help="portfolio sizes (10k, 1m, 10m or a number)")
+    parser.add_argument("--replications", type=int, default=100, help="Monte Carlo replications (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, help="Monte Carlo worker processes (default: %(default)s)")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="JSON lines file the results are appended to")
+    args = parser.parse_args()
+
+    previous = previous_records(args.output)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+    }
+    # The map and income extract of the scope are cached in the benchmark's directory too
+    ingest.CACHE_DIR = os.path.join(BENCH_DIR, "cache-sources")
+    units = sources.scope_communes()
+    map_data = sources.merge_map_data(sources.load_map(units), sources.load_city_exposure(), sources.load_filosofi(units))
+
+    # Portfolios are generated before memory tracing starts (tracing slows generation down)
+    paths = {size: portfolio_path(size) for size in args.sizes}
+    tracemalloc.start()
+    with open(args.output, "a") as out:
+        for size, path in paths.items():
+            print(f"\n{size} customers ({path})")
+            print(f"{'stage':<40}{'seconds':>10}{'peak RSS MB':>13}{'RSS +MB':>10}{'py alloc MB':>13}"
+                  f"{'previous':>10}{'change':>9}")
+            for result in run_suite(path, map_data, args.replications, args.workers):
+                record = {**run, "size": size, "rows": parse_size(size), **result}
+                out.write(json.dumps(record) + "\n")
+                before = previous.get((size, result["stage"]))
+                change = ""
+                if before:
+                    change = f"{result['seconds'] / before['seconds'] - 1:+.0%}" if before["seconds"] > 0 else ""
+                print(
+                    f"{result['stage']:<40}{result['seconds']:>10.3f}{result['peak_rss_mb']:>13.1f}"
+                    f"{result['rss_growth_mb']:>10.1f}{result['peak_py_alloc_mb']:>13.1f}"
+                    f"{before['seconds'] if before else float('nan'):>10.3f}{change:>9}"
+                )
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
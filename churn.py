@@ -0,0 +1,591 @@
+"""Customer churn model used by the Simulation page.
+
+Each customer churns independently with a probability driven by the burden of
+the new premium relative to the local median income and the insured
+patrimoine. The functions here only use numpy so they broadcast over customers
+(and over parameter values) and can run outside Streamlit.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+# Fixed simulation parameters (intentionally strict to highlight sensitivity)
+SIM_SEED = 123
+CHURN_SENSITIVITY = 1.6
+BURDEN_FOCUS = 0.8  # closer to 1 => income-driven churn
+BASE_CHURN = 0.12
+INCOME_THRESHOLD = 0.05  # lower threshold => higher sensitivity
+PATRIMOINE_THRESHOLD = 0.01
+
+BURDEN_CAP = 3
+MAX_CHURN = 0.95
+
+# Keyword names of the model constants accepted by churn_probability, with their defaults
+DEFAULT_PARAMS = {
+    "sensitivity": CHURN_SENSITIVITY,
+    "burden_focus": BURDEN_FOCUS,
+    "base_churn": BASE_CHURN,
+    "income_threshold": INCOME_THRESHOLD,
+    "patrimoine_threshold": PATRIMOINE_THRESHOLD,
+}
+
+# Number of uniform draws held in memory at once by the Monte Carlo engine (64 MB of float64)
+MC_CHUNK_ELEMENTS = 1 << 23
+# Smallest run (customers × replications) spread over worker processes; smaller runs are faster in-process
+PARALLEL_MIN_ELEMENTS = 1 << 26
+# Uniform draws of the Monte Carlo engine: independent ("pseudo-random"), antithetic pairs (u, 1 - u)
+# of consecutive replications, or a randomized Sobol sequence over the replications ("sobol")
+SAMPLERS = ("pseudo-random", "antithetic", "sobol")
+# Independent randomizations of the Sobol sequence; the confidence interval of the mean comes from their spread
+SOBOL_RANDOMIZATIONS = 16
+# Largest group whose stayer distribution is computed exactly; larger groups use the refined normal approximation
+EXACT_DISTRIBUTION_LIMIT = 10_000
+
+
+def premium_ratios(new_premium, median_income, patrimoine, out_income=None, out_patrimoine=None):
+    """Premium/income and premium/patrimoine ratios.
+
+    A zero income or patrimoine is treated as missing; a missing patrimoine ratio
+    falls back to a tenth of the income ratio. The ratios are written to
+    ``out_income`` / ``out_patrimoine`` when given (reusable buffers).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio_income = np.divide(new_premium, median_income, out=out_income)
+        ratio_income[np.asarray(median_income) == 0] = np.nan
+
+        ratio_patrimoine = np.divide(new_premium, patrimoine, out=out_patrimoine)
+        missing = (np.asarray(patrimoine) == 0) | np.isnan(ratio_patrimoine)
+        ratio_patrimoine[missing] = ratio_income[missing] * 0.1
+    return ratio_income, ratio_patrimoine
+
+
+def churn_probability(
+    ratio_income,
+    ratio_patrimoine,
+    sensitivity=CHURN_SENSITIVITY,
+    burden_focus=BURDEN_FOCUS,
+    base_churn=BASE_CHURN,
+    income_threshold=INCOME_THRESHOLD,
+    patrimoine_threshold=PATRIMOINE_THRESHOLD,
+    out=None,
+):
+    """Churn probability per customer (broadcasting over array-valued parameters).
+
+    Computed in place in ``out`` when given, so repeated runs can reuse one buffer.
+    """
+    if out is None:
+        shape = np.broadcast_shapes(
+            np.shape(ratio_income), np.shape(ratio_patrimoine), np.shape(sensitivity), np.shape(burden_focus),
+            np.shape(base_churn), np.shape(income_threshold), np.shape(patrimoine_threshold),
+        )
+        out = np.empty(shape)
+    churn = np.divide(ratio_income, income_threshold, out=out)
+    np.clip(churn, 0, BURDEN_CAP, out=churn)
+    churn *= burden_focus * 0.35
+    churn += base_churn
+    churn += (1 - burden_focus) * 0.25 * np.clip(ratio_patrimoine / patrimoine_threshold, 0, BURDEN_CAP)
+    churn *= sensitivity
+    return np.clip(churn, 0, MAX_CHURN, out=churn)
+
+
+def parameter_sweep(ratio_income, ratio_patrimoine, margin, grid, chunk_elements=MC_CHUNK_ELEMENTS):
+    """Expected churn rate and profit after churn for every point of a parameter grid.
+
+    ``grid`` maps parameter names (keys of ``DEFAULT_PARAMS``) to the values to
+    try; parameters left out keep their default. The premium ratios only depend
+    on the allocation, so they are computed once by the caller and the whole
+    grid is evaluated as (grid points x customers) broadcasts, a bounded number
+    of grid points at a time. Returns one row per point of the cartesian grid.
+    """
+    names = list(DEFAULT_PARAMS)
+    axes = [np.atleast_1d(np.asarray(grid.get(name, DEFAULT_PARAMS[name]), dtype=np.float64)) for name in names]
+    points = {name: values.ravel() for name, values in zip(names, np.meshgrid(*axes, indexing="ij"))}
+    n_points = len(points[names[0]])
+
+    ratio_income = np.asarray(ratio_income, dtype=np.float64)[None, :]
+    ratio_patrimoine = np.asarray(ratio_patrimoine, dtype=np.float64)[None, :]
+    margin = np.nan_to_num(np.asarray(margin, dtype=np.float64))
+    step = max(1, chunk_elements // max(ratio_income.shape[1], 1))
+
+    churn_rate = np.empty(n_points)
+    profit = np.empty(n_points)
+    for start in range(0, n_points, step):
+        sl = slice(start, min(start + step, n_points))
+        churn_prob = churn_probability(
+            ratio_income, ratio_patrimoine, **{name: points[name][sl, None] for name in names}
+        )
+        churn_rate[sl] = churn_prob.mean(axis=1)
+        profit[sl] = (1 - churn_prob) @ margin
+
+    result = pd.DataFrame(points)
+    result["churn_rate"] = churn_rate
+    result["realized_profit"] = profit
+    return result
+
+
+def churn_probability_gradient(
+    new_premium,
+    median_income,
+    patrimoine,
+    sensitivity=CHURN_SENSITIVITY,
+    burden_focus=BURDEN_FOCUS,
+    base_churn=BASE_CHURN,
+    income_threshold=INCOME_THRESHOLD,
+    patrimoine_threshold=PATRIMOINE_THRESHOLD,
+):
+    """Churn probability and its derivative with respect to the new premium.
+
+    The derivative is zero wherever a clip is active (burden capped, churn at 0 or
+    ``MAX_CHURN``) or the ratio is undefined.
+    """
+    ratio_income, ratio_patrimoine = premium_ratios(new_premium, median_income, patrimoine)
+    with np.errstate(divide="ignore"):
+        d_income = np.where(median_income == 0, 0.0, 1 / median_income)
+        d_patrimoine = np.where(patrimoine == 0, 0.1 * d_income, 1 / patrimoine)
+
+    scaled_income = ratio_income / income_threshold
+    scaled_patrimoine = ratio_patrimoine / patrimoine_threshold
+    raw = (
+        base_churn
+        + burden_focus * 0.35 * np.clip(scaled_income, 0, BURDEN_CAP)
+        + (1 - burden_focus) * 0.25 * np.clip(scaled_patrimoine, 0, BURDEN_CAP)
+    ) * sensitivity
+
+    d_raw = sensitivity * (
+        burden_focus * 0.35 * np.where((scaled_income > 0) & (scaled_income < BURDEN_CAP), d_income / income_threshold, 0.0)
+        + (1 - burden_focus) * 0.25
+        * np.where((scaled_patrimoine > 0) & (scaled_patrimoine < BURDEN_CAP), d_patrimoine / patrimoine_threshold, 0.0)
+    )
+    return np.clip(raw, 0, MAX_CHURN), np.where((raw > 0) & (raw < MAX_CHURN), d_raw, 0.0)
+
+
+def group_layout(codes, n_groups):
+    """Sort order making each group contiguous, plus the start of every non-empty group."""
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=n_groups)
+    nonempty = np.flatnonzero(counts)
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    return order, counts, nonempty, starts
+
+
+def replication_blocks(replications, n_customers, chunk_elements=MC_CHUNK_ELEMENTS, multiple=1):
+    """Split replications into blocks of bounded size (a multiple of ``multiple``); each block gets its own seed."""
+    size = max(1, min(replications, chunk_elements // max(n_customers, 1)))
+    size = max(multiple, size - size % multiple)
+    return [(start, min(start + size, replications)) for start in range(0, replications, size)]
+
+
+def sobol_replications(replications, randomizations=SOBOL_RANDOMIZATIONS):
+    """Number of replications a Sobol run draws for ``replications`` requested.
+
+    Scrambled Sobol points are only balanced in runs of a power of two, and the
+    confidence interval needs equal batches: the run holds ``randomizations``
+    batches of the power of two nearest to ``replications / randomizations``.
+    """
+    return randomizations * 2 ** max(0, round(np.log2(max(replications, 1) / randomizations)))
+
+
+def sobol_points(replications, seed=SIM_SEED, randomizations=SOBOL_RANDOMIZATIONS):
+    """Scrambled 1-D Sobol points for every replication, and the randomization each one belongs to.
+
+    Replications are split into ``randomizations`` consecutive batches, each an
+    independently scrambled Sobol sequence. Batches should be a power of two
+    (see ``sobol_replications``); scipy warns otherwise.
+    """
+    randomizations = max(1, min(randomizations, replications))
+    sizes = np.diff(np.linspace(0, replications, randomizations + 1).round().astype(int))
+    points = []
+    for size, seed_seq in zip(sizes, np.random.SeedSequence([seed, 1]).spawn(randomizations)):
+        points.append(qmc.Sobol(d=1, scramble=True, seed=np.random.default_rng(seed_seq)).random(size)[:, 0])
+    return np.concatenate(points), np.repeat(np.arange(randomizations), sizes)
+
+
+def block_uniforms(spec, n_customers):
+    """Uniform draws, shape (n_reps, n_customers), of one block of replications.
+
+    ``spec`` is ``(sampler, seed_seq, n_reps, sobol)``. Antithetic blocks hold
+    whole pairs: row ``2k + 1`` is ``1 - `` row ``2k``. Sobol draws are the
+    replication's Sobol point shifted modulo 1 by a uniform offset per customer
+    and randomization (a Cranley-Patterson rotation): every customer sees the
+    stratified sequence, and customers stay independent of each other.
+    """
+    sampler, seed_seq, n_reps, sobol = spec
+    rng = np.random.default_rng(seed_seq)
+    if sampler == "antithetic":
+        draws = np.empty((n_reps, n_customers))
+        half = rng.random(((n_reps + 1) // 2, n_customers))
+        draws[0::2] = half
+        np.subtract(1.0, half[:n_reps // 2], out=draws[1::2])
+        return draws
+    if sampler == "sobol":
+        points, batches, shift_seeds = sobol
+        draws = np.empty((n_reps, n_customers))
+        # Batches are consecutive runs of replications
+        for batch, first in zip(*np.unique(batches, return_index=True)):
+            rows = slice(first, first + np.count_nonzero(batches == batch))
+            shift = np.random.default_rng(shift_seeds[batch]).random(n_customers)
+            np.add(points[rows, None], shift, out=draws[rows])
+        return np.remainder(draws, 1.0, out=draws)
+    return rng.random((n_reps, n_customers))
+
+
+def simulate_block(spec, churn_prob, values, starts):
+    """Draw one block of replications (see ``block_uniforms``) for customers sorted by group.
+
+    Returns the stayers per non-empty group, shape (n_reps, len(starts)), and the
+    sum of each column of ``values`` over staying customers, shape (n_reps, k).
+    """
+    draws = block_uniforms(spec, len(churn_prob))
+    stayed = np.greater(draws, churn_prob, out=draws)  # 1.0 / 0.0, reusing the draw buffer
+    return np.add.reduceat(stayed, starts, axis=1), stayed @ values
+
+
+# Process-wide pool of Monte Carlo workers, created on first use and kept for later runs
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+# Shared arrays attached in a worker process, by segment specs (re-attached when a task brings new ones)
+_WORKER_ARRAYS = {}
+_WORKER_SEGMENTS = []
+_worker_specs = None
+
+
+def _worker_pool(workers):
+    """The process-wide pool, rebuilt when ``workers`` changes or after a worker died."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _drop_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _share_arrays(arrays, segments):
+    """Copy arrays into shared memory, appending the segments to ``segments``; returns the specs to attach them."""
+    specs = {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        segments.append(segment)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        specs[key] = (segment.name, array.shape, array.dtype.str)
+    return specs
+
+
+def _attach_arrays(specs):
+    global _worker_specs
+    if specs == _worker_specs:
+        return
+    # Views must go before their segments can be closed
+    _WORKER_ARRAYS.clear()
+    while _WORKER_SEGMENTS:
+        _WORKER_SEGMENTS.pop().close()
+    _worker_specs = None
+    for key, (name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=name)
+        _WORKER_SEGMENTS.append(segment)
+        _WORKER_ARRAYS[key] = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    _worker_specs = specs
+
+
+def _simulate_shared_block(shared, spec):
+    _attach_arrays(shared)
+    arrays = _WORKER_ARRAYS
+    return simulate_block(spec, arrays["churn_prob"], arrays["values"], arrays["starts"])
+
+
+def _run_blocks(blocks, specs, churn_prob, values, starts, workers):
+    """Yield ``(block, result)`` pairs, on the worker pool when ``workers > 1``.
+
+    Every block is drawn from its own seed whatever process runs it, so results
+    are identical for any number of workers. Workers read the customer arrays
+    from shared memory instead of receiving pickled copies; the segments only
+    live for this run, while the pool is kept for the next ones.
+    """
+    if workers <= 1 or len(blocks) <= 1:
+        for spec, block in zip(specs, blocks):
+            yield block, simulate_block(spec, churn_prob, values, starts)
+        return
+
+    segments, futures, pool = [], [], None
+    try:
+        shared = _share_arrays({"churn_prob": churn_prob, "values": values, "starts": starts}, segments)
+        pool = _worker_pool(workers)
+        futures = [pool.submit(_simulate_shared_block, shared, spec) for spec in specs]
+        for block, future in zip(blocks, futures):
+            yield block, future.result()
+    except BrokenProcessPool:
+        # A worker died: the next run starts a new pool
+        _drop_pool(pool)
+        raise
+    finally:
+        # Blocks not started yet are dropped when the caller stops early (e.g. a cancelled job);
+        # running ones must finish before their segments go away
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def monte_carlo_churn(
+    churn_prob, codes, n_groups, premium, expected_loss, replications, seed=SIM_SEED,
+    chunk_elements=MC_CHUNK_ELEMENTS, workers=1, progress=None, sampler=SAMPLERS[0],
+):
+    """Run ``replications`` churn draws, a block of replications at a time.
+
+    ``codes`` are group (arrondissement) codes in ``range(n_groups)``. Returns a
+    dict of per-replication arrays: ``stayers`` (R, n_groups), ``premium`` and
+    ``expected_loss`` collected on staying customers, and ``realized_profit``.
+    With ``workers > 1`` the blocks are spread over a process pool, when the run
+    holds at least ``PARALLEL_MIN_ELEMENTS`` draws.
+
+    The uniform draws only depend on ``seed``, ``sampler``, the number of
+    customers and their group codes, never on the churn probabilities: two
+    scenarios of the same portfolio run with the same seed use common random
+    numbers, so the per-replication difference of their results (see
+    ``paired_difference``) is far less noisy than the results themselves.
+    ``sampler`` is one of ``SAMPLERS``. Replications are then not all
+    independent (antithetic pairs, Sobol batches), so ``batch`` in the result
+    gives the number of consecutive replications forming one independent
+    sample, which ``summarize`` uses for confidence intervals. Sobol runs draw
+    ``sobol_replications(replications)`` replications, in equal batches.
+
+    ``progress(done, replications, partial)`` is called after every block, with
+    ``partial`` holding the same arrays for the first ``done`` replications; an
+    exception raised by it stops the run.
+    """
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler {sampler!r}; expected one of {', '.join(SAMPLERS)}")
+    order, counts, nonempty, starts = group_layout(codes, n_groups)
+    churn_prob = np.asarray(churn_prob, dtype=np.float64)[order]
+    values = np.column_stack([premium, expected_loss]).astype(np.float64)[order]
+
+    batch = 1
+    if sampler == "antithetic":
+        batch = 2
+    elif sampler == "sobol":
+        replications = sobol_replications(replications)
+        batch = replications // SOBOL_RANDOMIZATIONS
+    stayers = np.zeros((replications, n_groups))
+    sums = np.empty((replications, 2))
+    # Blocks hold whole batches, so partial results only summarize complete ones
+    blocks = replication_blocks(replications, len(churn_prob), chunk_elements, batch)
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+    sobol = [None] * len(blocks)
+    if sampler == "sobol":
+        points, batches = sobol_points(replications, seed)
+        shift_seeds = np.random.SeedSequence([seed, 2]).spawn(SOBOL_RANDOMIZATIONS)
+        sobol = [(points[start:stop], batches[start:stop], shift_seeds) for start, stop in blocks]
+    specs = [(sampler, seed_seq, stop - start, block_sobol) for seed_seq, (start, stop), block_sobol in zip(seeds, blocks, sobol)]
+
+    if len(churn_prob) * replications < PARALLEL_MIN_ELEMENTS:
+        workers = 1  # starting workers and sharing the arrays would cost more than the run
+    for (start, stop), (group_stayers, block_sums) in _run_blocks(
+        blocks, specs, churn_prob, values, starts, workers
+    ):
+        stayers[start:stop, nonempty] = group_stayers
+        sums[start:stop] = block_sums
+        if progress is not None:
+            # Blocks complete in order, so the first ``stop`` replications are final
+            progress(stop, replications, {
+                "stayers": stayers[:stop],
+                "premium": sums[:stop, 0],
+                "expected_loss": sums[:stop, 1],
+                "realized_profit": sums[:stop, 0] - sums[:stop, 1],
+                "batch": batch,
+            })
+
+    return {
+        "customers": counts,
+        "stayers": stayers,
+        "premium": sums[:, 0],
+        "expected_loss": sums[:, 1],
+        "realized_profit": sums[:, 0] - sums[:, 1],
+        "batch": batch,
+    }
+
+
+def summarize(samples, confidence=0.95, percentiles=(5, 50, 95), batch=1):
+    """Mean, spread, percentiles and confidence interval of the mean along axis 0.
+
+    With ``batch > 1`` consecutive groups of ``batch`` samples are correlated
+    (antithetic pairs, quasi-random batches): the confidence interval comes from
+    the spread of the batch means instead of the individual samples.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    n = samples.shape[0]
+    mean = samples.mean(axis=0)
+    std = samples.std(axis=0, ddof=1) if n > 1 else np.zeros_like(mean)
+    n_batches = n // batch
+    if batch > 1 and n_batches > 1:
+        batch_means = samples[:n_batches * batch].reshape(n_batches, batch, *samples.shape[1:]).mean(axis=1)
+        standard_error = batch_means.std(axis=0, ddof=1) / np.sqrt(n_batches)
+    else:
+        standard_error = std / np.sqrt(n)
+    half_width = NormalDist().inv_cdf(0.5 + confidence / 2) * standard_error
+    summary = {"mean": mean, "std": std, "ci_low": mean - half_width, "ci_high": mean + half_width}
+    for q, value in zip(percentiles, np.percentile(samples, percentiles, axis=0)):
+        summary[f"p{q}"] = value
+    return summary
+
+
+def summarize_monte_carlo(result, group_labels, confidence=0.95):
+    """Summary statistics of a ``monte_carlo_churn`` result.
+
+    Returns a dict of scalar summaries (stay rate, realized profit) and a
+    DataFrame of churn-rate summaries per group, indexed by ``group_labels``.
+    """
+    counts = result["customers"]
+    batch = result.get("batch", 1)
+    stay_rate = result["stayers"].sum(axis=1) / counts.sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_churn = np.where(counts > 0, 1 - result["stayers"] / counts, 0.0)
+    return {
+        "stay_rate": summarize(stay_rate, confidence, batch=batch),
+        "realized_profit": summarize(result["realized_profit"], confidence, batch=batch),
+        "premium": summarize(result["premium"], confidence, batch=batch),
+        "expected_loss": summarize(result["expected_loss"], confidence, batch=batch),
+        "group_churn": pd.DataFrame(summarize(group_churn, confidence, batch=batch), index=group_labels),
+    }
+
+
+def paired_difference(result, baseline, confidence=0.95):
+    """Summary of ``result`` minus ``baseline`` realized profit, replication by replication.
+
+    Both must come from ``monte_carlo_churn`` on the same portfolio with the same
+    seed, sampler and number of replications (common random numbers).
+    """
+    return summarize(result["realized_profit"] - baseline["realized_profit"], confidence, batch=result.get("batch", 1))
+
+
+def poisson_binomial_pmf(success_prob):
+    """Exact distribution of the number of successes among independent Bernoulli trials.
+
+    The generating polynomials ``(1 - p) + p·x`` are multiplied pairwise with
+    batched FFTs, so ``n`` trials cost O(n log² n).
+    """
+    success_prob = np.asarray(success_prob, dtype=np.float64)
+    polys = np.stack([1 - success_prob, success_prob], axis=1)
+    if len(polys) == 0:
+        return np.ones(1)
+    while len(polys) > 1:
+        if len(polys) % 2:
+            identity = np.zeros((1, polys.shape[1]))
+            identity[0, 0] = 1.0
+            polys = np.vstack([polys, identity])
+        degree = 2 * (polys.shape[1] - 1)
+        size = 1 << int(degree).bit_length()
+        spectra = np.fft.rfft(polys, n=size, axis=1)
+        polys = np.fft.irfft(spectra[0::2] * spectra[1::2], n=size, axis=1)[:, : degree + 1]
+    # Padding rows only add zero high-order coefficients
+    pmf = np.clip(polys[0][: len(success_prob) + 1], 0, None)
+    return pmf / pmf.sum()
+
+
+def refined_normal_cdf(k, mean, std, skew):
+    """Refined normal approximation of a Poisson-binomial CDF at the integers ``k``."""
+    normal = NormalDist()
+    x = (np.asarray(k, dtype=np.float64) + 0.5 - mean) / max(std, 1e-12)
+    cdf = np.array([normal.cdf(v) for v in x]) + skew * (1 - x**2) * np.array([normal.pdf(v) for v in x]) / 6
+    return np.clip(cdf, 0, 1)
+
+
+def count_distribution(success_prob, percentiles=(5, 50, 95)):
+    """Mean, standard deviation and percentiles of a Poisson-binomial count."""
+    success_prob = np.asarray(success_prob, dtype=np.float64)
+    mean = success_prob.sum()
+    variance = (success_prob * (1 - success_prob)).sum()
+    std = np.sqrt(variance)
+    summary = {"mean": mean, "std": std}
+    if len(success_prob) <= EXACT_DISTRIBUTION_LIMIT:
+        cdf = np.cumsum(poisson_binomial_pmf(success_prob))
+        ks = np.arange(len(cdf))
+    else:
+        skew = (success_prob * (1 - success_prob) * (1 - 2 * success_prob)).sum() / std**3
+        ks = np.arange(max(0, int(mean - 8 * std)), min(len(success_prob), int(mean + 8 * std) + 1) + 1)
+        cdf = np.maximum.accumulate(refined_normal_cdf(ks, mean, std, skew))
+    for q in percentiles:
+        summary[f"p{q}"] = ks[min(np.searchsorted(cdf, q / 100), len(ks) - 1)]
+    return summary
+
+
+def weighted_sum_distribution(success_prob, weights, percentiles=(5, 50, 95)):
+    """Mean, standard deviation and percentiles of ``sum(weights * Bernoulli(success_prob))``.
+
+    Percentiles use the Cornish-Fisher expansion with the exact skewness.
+    """
+    p = np.asarray(success_prob, dtype=np.float64)
+    w = np.asarray(weights, dtype=np.float64)
+    mean = (p * w).sum()
+    variance = (p * (1 - p) * w**2).sum()
+    std = np.sqrt(variance)
+    skew = (p * (1 - p) * (1 - 2 * p) * w**3).sum() / std**3 if std > 0 else 0.0
+    summary = {"mean": mean, "std": std}
+    for q in percentiles:
+        z = NormalDist().inv_cdf(q / 100)
+        summary[f"p{q}"] = mean + std * (z + (z**2 - 1) * skew / 6)
+    return summary
+
+
+def analytical_churn(churn_prob, codes, n_groups, premium, expected_loss, group_labels, progress=None):
+    """Exact churn statistics without sampling.
+
+    Staying is an independent Bernoulli(1 - churn_prob) per customer, so expected
+    stayers, premium and profit are exact sums. The stayer count per group is
+    Poisson-binomial, summarised by its exact (or refined normal) distribution;
+    profit percentiles use a skewness-corrected normal approximation.
+    ``progress(done, n_groups)`` is called after every group; it may raise to
+    abandon the computation.
+    """
+    stay_prob = 1 - np.asarray(churn_prob, dtype=np.float64)
+    premium = np.asarray(premium, dtype=np.float64)
+    expected_loss = np.asarray(expected_loss, dtype=np.float64)
+
+    order, counts, nonempty, starts = group_layout(codes, n_groups)
+    n_customers = counts.sum()
+    sorted_stay = stay_prob[order]
+    bounds = np.cumsum(counts) - counts
+    group_rows = []
+    for g in range(n_groups):
+        group_stay = sorted_stay[bounds[g]:bounds[g] + counts[g]]
+        stats = count_distribution(group_stay)
+        n = max(counts[g], 1)
+        # Churn rate = 1 - stayers / n: percentiles swap ends
+        group_rows.append({
+            "mean": 1 - stats["mean"] / n,
+            "std": stats["std"] / n,
+            "p5": 1 - stats["p95"] / n,
+            "p50": 1 - stats["p50"] / n,
+            "p95": 1 - stats["p5"] / n,
+        })
+        if progress is not None:
+            progress(g + 1, n_groups)
+
+    stayers = count_distribution(stay_prob)
+    return {
+        "customers": counts,
+        "stayers": np.bincount(codes, weights=stay_prob, minlength=n_groups),
+        "stay_rate": {key: value / n_customers for key, value in stayers.items()},
+        "premium": weighted_sum_distribution(stay_prob, premium),
+        "expected_loss": weighted_sum_distribution(stay_prob, expected_loss),
+        "realized_profit": weighted_sum_distribution(stay_prob, premium - expected_loss),
+        "group_churn": pd.DataFrame(group_rows, index=group_labels),
+    }
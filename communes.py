@@ -0,0 +1,53 @@
+"""Commune reference (INSEE code officiel géographique) and the scope of a run.
+
+``v_commune_2025.csv`` lists every commune (COM), municipal arrondissement
+(ARM, linked to its commune by COMPARENT) and delegated or associated
+commune. The pricing workflow works on "map units": communes, except that
+Paris, Lyon and Marseille are split into their arrondissements.
+
+A scope is a configuration string of ``FIELD=value,value`` clauses separated
+by ``;``, whose matches are combined, e.g. ``COM=75056`` (Paris, i.e. its 20
+arrondissements), ``DEP=69`` or ``REG=11;COM=13055``. FIELD is one of COM,
+DEP, REG, ARR (arrondissement départemental) or COMPARENT.
+"""
+import numpy as np
+import pandas as pd
+
+MAP_UNIT_TYPES = ("COM", "ARM")
+SCOPE_FIELDS = ("COM", "DEP", "REG", "ARR", "COMPARENT")
+
+
+def load_reference(path):
+    """Communes and municipal arrondissements indexed by their unique COM code."""
+    reference = pd.read_csv(path, dtype=str)
+    reference = reference[reference["TYPECOM"].isin(MAP_UNIT_TYPES)].set_index("COM")
+    # Communes split into arrondissements (Paris, Lyon, Marseille) are not map units themselves
+    reference["has_arm"] = reference.index.isin(reference["COMPARENT"].dropna())
+    return reference
+
+
+def parse_scope(scope):
+    """``{field: [values]}`` of a scope string; raises ValueError on unknown fields."""
+    clauses = {}
+    for clause in filter(None, (part.strip() for part in scope.split(";"))):
+        field, _, values = clause.partition("=")
+        field = field.strip().upper()
+        if field not in SCOPE_FIELDS or not values.strip():
+            raise ValueError(f"Invalid scope clause {clause!r}: expected FIELD=value,... with FIELD in {SCOPE_FIELDS}")
+        clauses.setdefault(field, []).extend(v.strip() for v in values.split(",") if v.strip())
+    return clauses
+
+
+def scope_units(reference, scope):
+    """Sorted COM codes of the map units covered by ``scope``."""
+    mask = np.zeros(len(reference), dtype=bool)
+    for field, values in parse_scope(scope).items():
+        column = reference.index if field == "COM" else reference[field]
+        mask |= column.isin(values)
+    selected = reference[mask]
+    children = reference[reference["COMPARENT"].isin(selected.index[selected["has_arm"]])]
+    units = selected.index[~selected["has_arm"]].union(children.index)
+    if units.empty:
+        raise ValueError(f"Scope {scope!r} does not match any commune")
+    return units.sort_values().tolist()
+
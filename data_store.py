@@ -0,0 +1,60 @@
+"""Process-wide data store shared by every page and every browser session.
+
+The source files are parsed and merged once per process (see sources.py) and
+the result is kept in a ``st.cache_resource`` entry keyed by the files'
+modification times, so a workshop of many participants shares a single copy
+in RAM. Sessions only hold references to the shared frames; they must treat
+them as read-only and keep their own allocations in ``st.session_state``.
+"""
+import streamlit as st
+
+import communes
+import sources
+from sources import COMMUNES_PATH, SCOPE, file_signature
+
+
+@st.cache_resource(max_entries=1)
+def _commune_reference(signature):
+    return communes.load_reference(COMMUNES_PATH)
+
+
+@st.cache_resource(max_entries=4)
+def _scope_units(signature, scope):
+    return communes.scope_units(_commune_reference(signature), scope)
+
+
+def scope_communes():
+    """COM codes of the map units in ``SCOPE``, resolved once per version of the reference."""
+    return _scope_units(file_signature(COMMUNES_PATH), SCOPE)
+
+
+def data_version():
+    """Fingerprint of all source files; changes whenever one of them is rewritten."""
+    return sources.data_version(scope_communes())
+
+
+@st.cache_resource(show_spinner="Loading data...", max_entries=1)
+def _shared_data(version):
+    # ``version`` is only used as the cache key: a new fingerprint evicts the old entry
+    return sources.build_base_data(scope_communes())
+
+
+def get_shared_data():
+    """Return the process-wide data for the current version of the source files."""
+    return _shared_data(data_version())
+
+
+def ensure_data_loaded():
+    """Point session state at the shared data (no per-session parsing or copying)."""
+    version = data_version()
+    shared = _shared_data(version)
+    st.session_state.data = shared["data"]
+    st.session_state.customers = shared["customers"]
+    st.session_state.data_version = version
+    dropped = {reason: units for reason, units in shared["dropped_units"].items() if units}
+    if dropped:
+        st.warning(
+            f"{sum(map(len, dropped.values()))} units of the scope {SCOPE!r} are left out: "
+            + "; ".join(f"{reason}: {', '.join(units)}" for reason, units in dropped.items())
+        )
+    return shared
@@ -0,0 +1,161 @@
+"""Evaluate a file of allocation scenarios without the user interface.
+
+Each scenario is one allocation of the target over the arrondissements: a row
+of a CSV file or an item of a JSON list. Amounts are given either by
+arrondissement code (CSV columns or JSON object keys such as ``75101``;
+missing codes get 0) or as a plain vector in code order (CSV without code
+columns, JSON list of lists). A CSV file whose first row holds only numbers
+(and no code) has no header: every row is a scenario. An optional
+``scenario`` column or key names the scenario; otherwise scenarios are
+numbered from 0.
+
+For every scenario the Dashboard's resulting metrics and the churn simulation
+of the Simulation page are computed (see scenarios.py). Scenarios run in
+parallel on a process pool, and all the results go to one Parquet file, one row
+per scenario in input order. Every scenario is simulated with the same seed,
+so Monte Carlo results share common random numbers: differences between
+scenarios are much less noisy than the results themselves. Results are kept in
+the scenario result cache (see result_cache.py), so scenarios evaluated before
+with the same data and settings are not recomputed.
+
+Usage::
+
+    python evaluate_scenarios.py scenarios.csv
+    python evaluate_scenarios.py scenarios.json --mode analytical --income-input deciles --output results.parquet
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import sources
+from allocation import SPLIT_MODES
+from churn import SAMPLERS, SOBOL_RANDOMIZATIONS, sobol_replications
+from scenarios import DEFAULT_REPLICATIONS, INCOME_INPUTS, INCOME_LEVELS, SIMULATION_MODES, build_context, cached_scenario
+
+OUTPUT_PATH = "scenario_results.parquet"
+MODES = dict(zip(("single", "monte-carlo", "analytical"), SIMULATION_MODES))
+GRANULARITIES = dict(zip(("arrondissement", "iris"), INCOME_LEVELS))
+INCOME_INPUT_NAMES = dict(zip(("median", "deciles"), INCOME_INPUTS))
+SPLITS = {name.lower().replace(" ", "-"): name for name in SPLIT_MODES}
+
+# Scenario context of a pool worker, loaded once per process
+_WORKER_CONTEXT = {}
+
+
+def load_context():
+    """Scenario context of the current source files (the columnar caches are reused when fresh)."""
+    units = sources.scope_communes()
+    version = sources.data_version(units)
+    return build_context(sources.build_base_data(units), version)
+
+
+def read_csv_scenarios(path, codes):
+    """Rows of a scenario CSV file, its first row being the header unless it only holds amounts."""
+    table = pd.read_csv(path, header=None, dtype=str)
+    if table.empty:
+        return table
+    first = table.iloc[0]
+    amounts = pd.to_numeric(first, errors="coerce").notna() | first.isna()
+    if amounts.all() and not first.isin(codes).any():
+        return table
+    # Read again with the header so pandas parses the amounts and names unique columns
+    return pd.read_csv(path)
+
+
+def read_scenarios(path, codes):
+    """Scenario names and an allocation table (one row per scenario, one column per code)."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            table = pd.DataFrame(json.load(f))
+    else:
+        table = read_csv_scenarios(path, codes)
+    table.columns = table.columns.astype(str)
+    names = table.pop("scenario").astype(str) if "scenario" in table.columns else pd.Series(range(len(table))).astype(str)
+
+    if set(table.columns) & set(codes):
+        unknown = sorted(set(table.columns) - set(codes))
+        if unknown:
+            raise ValueError(f"Unknown arrondissement codes: {', '.join(unknown)}")
+        table = table.reindex(columns=codes)
+    elif len(table.columns) == len(codes):
+        table.columns = codes
+    else:
+        raise ValueError(
+            f"Expected {len(codes)} amounts per scenario (or columns named by arrondissement code), "
+            f"got {len(table.columns)}"
+        )
+    return names.tolist(), table.apply(pd.to_numeric, errors="raise").fillna(0.0)
+
+
+def _init_worker():
+    _WORKER_CONTEXT["context"] = load_context()
+
+
+def _evaluate(task):
+    name, allocation, options = task
+    return {"scenario": name, **cached_scenario(_WORKER_CONTEXT["context"], allocation, **options)}
+
+
+def evaluate_all(context, names, table, options, workers=1):
+    """One result row per scenario, in input order; on ``workers`` processes when more than one."""
+    tasks = [(name, row, options) for name, row in zip(names, table.to_numpy())]
+    if workers <= 1 or len(tasks) <= 1:
+        return [{"scenario": name, **cached_scenario(context, allocation, **options)} for name, allocation, options in tasks]
+
+    # Workers load the data themselves: the customer cache is memory-mapped, so its pages are shared
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(tasks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as pool:
+        return list(pool.map(_evaluate, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scenarios", help="CSV or JSON file of allocation scenarios; a CSV header is optional for plain vectors")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Parquet results file (default: %(default)s)")
+    parser.add_argument("--mode", choices=MODES, default="single", help="churn simulation mode (default: %(default)s)")
+    parser.add_argument("--replications", type=int, default=DEFAULT_REPLICATIONS,
+                        help="Monte Carlo replications (default: %(default)s)")
+    parser.add_argument("--sampler", choices=SAMPLERS, default=SAMPLERS[0],
+                        help="Monte Carlo uniform draws (default: %(default)s)")
+    parser.add_argument("--split", choices=SPLITS, default="equal",
+                        help="how an arrondissement's amount is shared among its customers (default: %(default)s)")
+    parser.add_argument("--income-granularity", choices=GRANULARITIES,
+                        help="income areas (default: iris when the customers carry IRIS codes, else arrondissement)")
+    parser.add_argument("--income-input", choices=INCOME_INPUT_NAMES, default="median")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: the number of CPUs)")
+    args = parser.parse_args()
+
+    if args.mode == "monte-carlo" and args.sampler == "sobol":
+        rounded = sobol_replications(args.replications)
+        if rounded != args.replications:
+            print(f"Sobol runs {rounded:,} replications: {SOBOL_RANDOMIZATIONS} randomizations of "
+                  f"{rounded // SOBOL_RANDOMIZATIONS:,}, the nearest power of two.")
+        args.replications = rounded
+
+    context = load_context()
+    names, table = read_scenarios(args.scenarios, context["codes"])
+    options = {
+        "mode": MODES[args.mode],
+        "granularity": GRANULARITIES.get(args.income_granularity, context["income_level"]),
+        "income_input": INCOME_INPUT_NAMES[args.income_input],
+        "replications": args.replications,
+        "sampler": args.sampler,
+        "split": SPLITS[args.split],
+    }
+    results = pd.DataFrame(evaluate_all(context, names, table, options, args.workers))
+    for key, value in options.items():
+        results[key] = value
+    results.to_parquet(args.output, index=False)
+    print(f"Evaluated {len(results):,} scenarios into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Generate a synthetic customers.csv calibrated to city_exposure.csv.
+
+city_exposure.csv holds, per arrondissement, the number of insured customers
+(``index``), their total patrimoine, their average claim probability and the
+average premium (the expected loss per customer). The generated portfolio
+reproduces those proportions at any size:
+
+- customers are spread over arrondissements in proportion to ``index``;
+- patrimoine is lognormal with the arrondissement's mean patrimoine per customer;
+- prob is lognormal around the arrondissement's claim probability;
+- model_premium is the customer's expected loss times a loading, with some pricing noise.
+
+Usage::
+
+    python generate_customers.py 1m                       # writes customers.csv
+    python generate_customers.py 10k --output small.csv --seed 7
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+CITY_EXPOSURE_PATH = "city_exposure.csv"
+GENERATOR_SEED = 20_240_901
+# Rows drawn from one random stream spawned from the seed; changing it changes the portfolio
+BLOCK_ROWS = 1_000_000
+# Blocks generated and written at once; the portfolio does not depend on this value
+CHUNK_BLOCKS = 1
+PATRIMOINE_SIGMA = 0.6
+PROB_SIGMA = 0.3
+PREMIUM_NOISE_SIGMA = 0.1
+PREMIUM_LOADING = 1.0
+
+
+def parse_size(size):
+    """Number of rows from a preset name (10k, 1m, 10m) or a plain integer."""
+    return SIZES[size.lower()] if size.lower() in SIZES else int(size)
+
+
+def lognormal_with_mean(rng, mean, sigma, size):
+    """Lognormal draws whose expectation is ``mean`` (element-wise)."""
+    return mean * rng.lognormal(-0.5 * sigma**2, sigma, size)
+
+
+def generate_chunk(rng, exposure, n_rows, loading=PREMIUM_LOADING):
+    """``n_rows`` customers drawn from the per-arrondissement profile ``exposure``."""
+    weights = exposure["index"].to_numpy(dtype=np.float64)
+    group = rng.choice(len(exposure), size=n_rows, p=weights / weights.sum())
+    mean_patrimoine = (exposure["patrimoine"] / exposure["index"]).to_numpy()[group]
+    patrimoine = np.round(lognormal_with_mean(rng, mean_patrimoine, PATRIMOINE_SIGMA, n_rows))
+    prob = np.clip(lognormal_with_mean(rng, exposure["prob"].to_numpy()[group], PROB_SIGMA, n_rows), 0.0, 1.0)
+    model_premium = patrimoine * prob * loading * lognormal_with_mean(rng, 1.0, PREMIUM_NOISE_SIGMA, n_rows)
+    return pd.DataFrame(
+        {
+            "COM": exposure["COM"].to_numpy()[group],
+            "prob": prob,
+            "patrimoine": patrimoine,
+            "model_premium": model_premium,
+        }
+    )
+
+
+def generate_customers(n_rows, output_path, seed=GENERATOR_SEED, loading=PREMIUM_LOADING,
+                       exposure_path=CITY_EXPOSURE_PATH):
+    """Write ``n_rows`` synthetic customers to ``output_path``, one chunk at a time.
+
+    Block ``i`` holds rows ``i * BLOCK_ROWS`` onwards and draws them from the
+    ``i``-th stream spawned from ``seed``, so the portfolio is the same
+    whatever the chunk size.
+    """
+    exposure = pd.read_csv(exposure_path, dtype={"COM": str})
+    block_seeds = np.random.SeedSequence(seed).spawn(-(-n_rows // BLOCK_ROWS))
+    tmp_path = output_path + ".tmp"
+    for first in range(0, len(block_seeds), CHUNK_BLOCKS):
+        blocks = []
+        for i in range(first, min(first + CHUNK_BLOCKS, len(block_seeds))):
+            rows = min(BLOCK_ROWS, n_rows - i * BLOCK_ROWS)
+            blocks.append(generate_chunk(np.random.default_rng(block_seeds[i]), exposure, rows, loading))
+        chunk = pd.concat(blocks, ignore_index=True)
+        chunk.to_csv(tmp_path, mode="w" if first == 0 else "a", header=first == 0, index=False)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("size", help="number of customers, or one of: " + ", ".join(SIZES))
+    parser.add_argument("--output", default="customers.csv")
+    parser.add_argument("--seed", type=int, default=GENERATOR_SEED)
+    parser.add_argument("--loading", type=float, default=PREMIUM_LOADING,
+                        help="model premium as a multiple of the expected loss (default: %(default)s)")
+    args = parser.parse_args()
+    n_rows = parse_size(args.size)
+    generate_customers(n_rows, args.output, args.seed, args.loading)
+    print(f"Wrote {n_rows:,} customers to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
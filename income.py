@@ -0,0 +1,61 @@
+"""Income distributions rebuilt from Filosofi deciles.
+
+Each area (arrondissement or IRIS cell) is described by its nine deciles
+D1..D9 (D5 is the median). The inverse CDF interpolates linearly between them
+and extends the end segments into the tails, so drawing an income for every
+customer, or for every customer and replication, is one vectorized gather
+over a ``(areas, 9)`` table.
+"""
+import numpy as np
+
+from churn import MC_CHUNK_ELEMENTS, churn_probability, premium_ratios
+
+DECILE_COLUMNS = [f"DISP_D{d}18" for d in (1, 2, 3, 4)] + ["DISP_MED18"] + [f"DISP_D{d}18" for d in (6, 7, 8, 9)]
+N_DECILES = len(DECILE_COLUMNS)
+INCOME_SEED = 2019
+# Midpoints in probability space used to average the churn probability over an income distribution
+QUADRATURE_NODES = 32
+# The extrapolated lower tail never goes below this share of D1
+LOWER_TAIL_FLOOR = 0.5
+
+
+def income_quantile(deciles, rows, u):
+    """Income at probability ``u`` for customers whose distribution is ``deciles[rows]``.
+
+    ``u`` broadcasts against ``rows`` (e.g. ``(replications, customers)``).
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    position = np.asarray(u) * (N_DECILES + 1) - 1
+    segment = np.clip(np.floor(position), 0, N_DECILES - 2).astype(np.intp)
+    flat = deciles.ravel()
+    base = rows * N_DECILES + segment
+    low = np.take(flat, base)
+    high = np.take(flat, base + 1)
+    income = low + (position - segment) * (high - low)
+    return np.maximum(income, LOWER_TAIL_FLOOR * np.take(flat, rows * N_DECILES), out=income)
+
+
+def sample_income(deciles, rows, n_reps=None, seed=INCOME_SEED):
+    """One income per customer, or an ``(n_reps, customers)`` batch, by inverse-CDF sampling."""
+    shape = len(rows) if n_reps is None else (n_reps, len(rows))
+    return income_quantile(deciles, rows, np.random.default_rng(seed).random(shape))
+
+
+def expected_churn(new_premium, patrimoine, deciles, rows, n_nodes=QUADRATURE_NODES,
+                   chunk_elements=MC_CHUNK_ELEMENTS, **params):
+    """Churn probability of each customer averaged over their income distribution.
+
+    Drawing an income and then the churn outcome is the same Bernoulli draw as
+    churning with this averaged probability, so the Monte Carlo and exact engines
+    can take it as is.
+    """
+    nodes = (np.arange(n_nodes) + 0.5) / n_nodes
+    step = max(1, chunk_elements // max(len(rows), 1))
+    total = np.zeros(len(rows))
+    for start in range(0, n_nodes, step):
+        income = income_quantile(deciles, rows, nodes[start:start + step, None])
+        ratio_income, ratio_patrimoine = premium_ratios(
+            new_premium, income, np.broadcast_to(patrimoine, income.shape)
+        )
+        total += churn_probability(ratio_income, ratio_patrimoine, **params).sum(axis=0)
+    return total / n_nodes
@@ -0,0 +1,359 @@
+"""Ingest stages converting the raw source files into typed columnar caches.
+
+Each cache lives in ``CACHE_DIR`` next to a small JSON file recording the
+fingerprint (modification time, size and SHA-256) of the source it was built
+from. A cache is rebuilt only when the source content actually changes; a
+touched but identical file just refreshes the recorded modification time.
+
+Every page rerun checks the caches, so sessions (threads) and tools
+(processes) may meet on a stale one: its check and rebuild run under
+``build_lock``, and files are written to a temporary name unique to the
+process and thread, then moved into place.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: rebuilds are then only serialized within the process
+    fcntl = None
+
+CACHE_DIR = ".cache"
+HASH_CHUNK_SIZE = 1 << 20
+
+# Rows parsed at once when converting customers.csv, bounding peak memory on very large books
+CSV_CHUNK_ROWS = 1_000_000
+# dtype of the customer value columns: float32 halves their memory, float64 keeps full precision
+CUSTOMER_FLOAT_DTYPE = os.environ.get("CUSTOMER_FLOAT_DTYPE", "float32")
+CUSTOMER_FLOAT_COLUMNS = ("prob", "patrimoine", "model_premium")
+# Code columns of customers.csv kept as strings; every other column is read as float64
+CUSTOMER_CODE_COLUMNS = ("COM", "IRIS")
+
+# Filosofi 2018 IRIS workbook: data sheet and row holding the variable codes
+IRIS_SHEET = "IRIS_DISP"
+IRIS_HEADER_ROW = 5
+IRIS_CODE_COLUMNS = ("IRIS", "LIBIRIS", "COM", "LIBCOM")
+# Disposable income deciles kept in filosofi_filtered.csv (the 5th decile is the median)
+FILOSOFI_COLUMNS = [f"DISP_D{d}18" for d in (1, 2, 3, 4, 6, 7, 8, 9)] + ["DISP_MED18"]
+# Geometries are cached in the CRS the maps are drawn in
+MAP_CRS = "EPSG:4326"
+
+# Optional IRIS population table (INSEE "base-ic-evol-struct-pop"): IRIS code and population
+IRIS_POPULATION_COLUMNS = ("IRIS", "P18_POP")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def units_digest(units):
+    """Short digest of a set of map units, naming the caches built for one scope."""
+    return hashlib.sha256(",".join(sorted(units)).encode()).hexdigest()[:16]
+
+
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+
+def tmp_path_for(path):
+    """Temporary name to write ``path`` under before moving it into place, unique to this process and thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+@contextmanager
+def build_lock(name):
+    """Hold the lock of cache ``name``, shared by the threads of the process and, through a lock file, by processes."""
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(name, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, f"{name}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def cache_paths(name, extension):
+    return (
+        os.path.join(CACHE_DIR, f"{name}.{extension}"),
+        os.path.join(CACHE_DIR, f"{name}.meta.json"),
+    )
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(meta_path, meta):
+    tmp_path = tmp_path_for(meta_path)
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def is_cache_fresh(source_path, cache_path, meta_path, settings=None):
+    """Check whether ``cache_path`` was built from the current content of ``source_path``.
+
+    ``settings`` are recorded build options; the cache is stale if any of them changed.
+    """
+    meta = _read_meta(meta_path)
+    if meta is None or not os.path.exists(cache_path):
+        return False
+    if any(meta.get(key) != value for key, value in (settings or {}).items()):
+        return False
+    stat = os.stat(source_path)
+    if meta.get("mtime_ns") == stat.st_mtime_ns and meta.get("size") == stat.st_size:
+        return True
+    # The file was touched or rewritten: only its content decides
+    if meta.get("size") != stat.st_size or meta.get("sha256") != file_sha256(source_path):
+        return False
+    meta["mtime_ns"] = stat.st_mtime_ns
+    _write_meta(meta_path, meta)
+    return True
+
+
+def record_source(source_path, meta_path, **extra):
+    stat = os.stat(source_path)
+    meta = {
+        "source": source_path,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_sha256(source_path),
+    }
+    meta.update(extra)
+    _write_meta(meta_path, meta)
+
+
+def write_feather(df, path):
+    """Write an uncompressed Arrow IPC file so it can be memory-mapped back."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = tmp_path_for(path)
+    df.reset_index(drop=True).to_feather(tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def read_feather_mmap(path):
+    """Memory-map an Arrow IPC file; numeric columns are not copied into RAM."""
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def customer_schema(columns, float_dtype):
+    """Arrow schema of the customer cache for the CSV ``columns``, fixed before any row is read."""
+    fields = []
+    for col in columns:
+        if col == "COM":
+            fields.append((col, pa.int32()))
+        elif col in CUSTOMER_CODE_COLUMNS:
+            fields.append((col, pa.string()))
+        elif col in CUSTOMER_FLOAT_COLUMNS:
+            fields.append((col, pa.from_numpy_dtype(np.dtype(float_dtype))))
+        else:
+            fields.append((col, pa.float64()))
+    return pa.schema(fields)
+
+
+def _customer_chunk(chunk, categories, schema):
+    """Columns of one parsed chunk: COM as int32 codes into the growing ``categories`` list.
+
+    A missing COM becomes the code "nan", which no scope contains.
+    """
+    com = chunk["COM"].fillna("nan")
+    known = set(categories)
+    categories.extend(code for code in com.unique() if code not in known)
+    columns = [pa.array(pd.Index(categories).get_indexer(com).astype(np.int32))]
+    for field in map(schema.field, schema.names[1:]):
+        if pa.types.is_string(field.type):
+            columns.append(pa.Array.from_pandas(chunk[field.name], type=field.type))
+        else:
+            columns.append(pa.array(chunk[field.name].to_numpy(dtype=field.type.to_pandas_dtype())))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def ingest_customers(csv_path, float_dtype=CUSTOMER_FLOAT_DTYPE, chunk_rows=CSV_CHUNK_ROWS):
+    """Convert customers.csv into a typed Arrow IPC cache, one chunk of rows at a time.
+
+    Returns the cache path and its metadata (which holds the COM categories).
+    """
+    cache_path, meta_path = cache_paths("customers", "arrow")
+    settings = {"float_dtype": float_dtype, "com_encoding": "codes"}
+    with build_lock("customers"):
+        if not is_cache_fresh(csv_path, cache_path, meta_path, settings):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            header = pd.read_csv(csv_path, nrows=0).columns
+            # COM first: the schema and the chunks list the columns in the same order
+            columns = ["COM"] + [col for col in header if col != "COM"]
+            schema = customer_schema(columns, float_dtype)
+            dtypes = {col: (str if col in CUSTOMER_CODE_COLUMNS else np.float64) for col in columns}
+            tmp_path = tmp_path_for(cache_path)
+            categories, rows = [], 0
+            # The writer exists before the first chunk, so a CSV without rows gives an empty cache
+            with pa.ipc.new_file(tmp_path, schema) as writer:
+                for chunk in pd.read_csv(csv_path, dtype=dtypes, chunksize=chunk_rows):
+                    writer.write_table(_customer_chunk(chunk, categories, schema))
+                    rows += len(chunk)
+            os.replace(tmp_path, cache_path)
+            record_source(csv_path, meta_path, rows=rows, com_categories=categories, **settings)
+    return cache_path, _read_meta(meta_path)
+
+
+def load_customers(csv_path, float_dtype=CUSTOMER_FLOAT_DTYPE):
+    """Load the customer table through its columnar cache (building it on first use).
+
+    Value columns are memory-mapped; COM comes back as a categorical of strings.
+    """
+    cache_path, meta = ingest_customers(csv_path, float_dtype)
+    customers = read_feather_mmap(cache_path)
+    customers["COM"] = pd.Categorical.from_codes(
+        customers["COM"].to_numpy(), categories=meta["com_categories"]
+    ).reorder_categories(sorted(meta["com_categories"]))
+    return customers
+
+
+def ingest_iris(xlsx_path):
+    """Convert the Filosofi IRIS sheet into an Arrow IPC cache (parsing the workbook is slow)."""
+    cache_path, meta_path = cache_paths("iris_disp", "arrow")
+    settings = {"sheet": IRIS_SHEET, "header": IRIS_HEADER_ROW}
+    with build_lock("iris_disp"):
+        if not is_cache_fresh(xlsx_path, cache_path, meta_path, settings):
+            iris = pd.read_excel(
+                xlsx_path,
+                sheet_name=IRIS_SHEET,
+                header=IRIS_HEADER_ROW,
+                dtype={col: str for col in IRIS_CODE_COLUMNS},
+            )
+            write_feather(iris, cache_path)
+            record_source(xlsx_path, meta_path, rows=len(iris), **settings)
+    return cache_path
+
+
+def load_iris(xlsx_path):
+    """IRIS-level income indicators, through their columnar cache."""
+    return read_feather_mmap(ingest_iris(xlsx_path))
+
+
+def load_iris_population(population_path):
+    """Population per IRIS code, or None when the population table is not available."""
+    if not population_path or not os.path.exists(population_path):
+        return None
+    code, population = IRIS_POPULATION_COLUMNS
+    table = pd.read_csv(population_path, sep=None, engine="python", usecols=[code, population], dtype={code: str})
+    return table.groupby(code)[population].sum()
+
+
+def aggregate_iris(iris, columns, weights=None, by="COM"):
+    """Weighted mean of ``columns`` over the IRIS of each ``by`` group.
+
+    Each column is averaged over the IRIS where it is published; without
+    ``weights`` every IRIS counts equally.
+    """
+    values = iris[columns]
+    weights = pd.Series(1.0, index=iris.index) if weights is None else weights.fillna(0.0)
+    weighted_sum = values.mul(weights, axis=0).groupby(iris[by]).sum()
+    weight_total = values.notna().mul(weights, axis=0).groupby(iris[by]).sum()
+    return weighted_sum / weight_total.where(weight_total > 0)
+
+
+def build_filosofi(xlsx_path, communes, population_path=None):
+    """Build the income extract of ``communes`` from the IRIS workbook; returns its cache path.
+
+    There is one extract per scope, rebuilt only when the workbook (or the
+    population table) changed since the last build. IRIS are weighted by
+    population when ``population_path`` exists, else equally, which
+    reproduces the shipped filosofi_filtered.csv for Paris.
+    """
+    weighted = bool(population_path) and os.path.exists(population_path)
+    digest = units_digest(communes)
+    settings = {"units_sha256": digest, "weighted": weighted}
+    output_path, meta_path = cache_paths(f"filosofi-{digest}", "csv")
+    population_meta_path = cache_paths(f"filosofi-{digest}.population", "csv")[1]
+    with build_lock(f"filosofi-{digest}"):
+        if is_cache_fresh(xlsx_path, output_path, meta_path, settings) and (
+            not weighted or is_cache_fresh(population_path, output_path, population_meta_path)
+        ):
+            return output_path
+
+        iris = load_iris(xlsx_path)
+        iris = iris[iris["COM"].isin(communes)]
+        weights = iris["IRIS"].map(load_iris_population(population_path)).astype(float) if weighted else None
+        filosofi = aggregate_iris(iris, FILOSOFI_COLUMNS, weights).reset_index()
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = tmp_path_for(output_path)
+        filosofi.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, output_path)
+        record_source(xlsx_path, meta_path, rows=len(filosofi), **settings)
+        if weighted:
+            record_source(population_path, population_meta_path)
+    return output_path
+
+
+def shapefile_parts(shapefile_path):
+    """Files of a shapefile: the .shp and every sidecar sharing its name (.shx, .dbf, .prj, .cpg...)."""
+    stem = os.path.splitext(shapefile_path)[0]
+    return sorted(glob.glob(glob.escape(stem) + ".*"))
+
+
+def ingest_map(shapefile_path, units, id_column="insee"):
+    """Features of ``units`` reprojected to ``MAP_CRS`` and cached as GeoParquet.
+
+    The attribute filter is pushed down to the OGR driver, so only the scope's
+    features are decoded. There is one cache per scope; each is rebuilt only
+    when one of the shapefile's files changes, appears or disappears (the
+    .prj decides the source CRS and the .cpg the attribute encoding).
+    """
+    units = sorted(units)
+    digest = units_digest(units)
+    cache_path, meta_path = cache_paths(f"map-{digest}", "parquet")
+    sidecars = [path for path in shapefile_parts(shapefile_path) if path != shapefile_path]
+    sidecar_meta = [
+        (path, cache_paths(f"map-{digest}{os.path.splitext(path)[1]}", "parquet")[1]) for path in sidecars
+    ]
+    settings = {
+        "units_sha256": digest,
+        "crs": MAP_CRS,
+        "sidecars": [os.path.splitext(path)[1] for path in sidecars],
+    }
+    with build_lock(f"map-{digest}"):
+        if not (
+            is_cache_fresh(shapefile_path, cache_path, meta_path, settings)
+            and all(is_cache_fresh(path, cache_path, part_meta) for path, part_meta in sidecar_meta)
+        ):
+            codes = ",".join(f"'{code}'" for code in units)
+            map_df = gpd.read_file(shapefile_path, engine="pyogrio", where=f"{id_column} IN ({codes})")
+            map_df = map_df.to_crs(MAP_CRS)
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = tmp_path_for(cache_path)
+            map_df.to_parquet(tmp_path)
+            os.replace(tmp_path, cache_path)
+            for path, part_meta in sidecar_meta:
+                record_source(path, part_meta)
+            record_source(shapefile_path, meta_path, rows=len(map_df), **settings)
+    return cache_path
+
+
+def load_map(shapefile_path, units, id_column="insee"):
+    """Map features of ``units``, through their GeoParquet cache."""
+    return gpd.read_parquet(ingest_map(shapefile_path, units, id_column))
@@ -0,0 +1,74 @@
+"""IRIS cells (sub-arrondissement areas) and their disposable incomes.
+
+The IRIS of the mapped arrondissements are indexed once per data version:
+cells are sorted by arrondissement so that each arrondissement owns a
+contiguous block. Customers are then attached to a cell either by an indexed
+lookup of their IRIS code or, when the portfolio only records the
+arrondissement, by a seeded draw within their arrondissement weighted by IRIS
+population. Per-customer incomes are a single ``np.take`` on the cell index.
+"""
+import numpy as np
+import pandas as pd
+
+from income import DECILE_COLUMNS
+
+IRIS_SEED = 2018
+INCOME_COLUMN = "DISP_MED18"
+
+
+def build_iris_index(iris, communes, population=None):
+    """Index of the IRIS cells of ``communes``.
+
+    ``population`` (Series indexed by IRIS code) weights the draw of
+    customers without an IRIS code; cells without population count as empty
+    unless the whole arrondissement lacks it, in which case cells are equally likely.
+    """
+    communes = pd.Index(sorted(communes))
+    iris = iris[iris["COM"].isin(communes)].sort_values(["COM", "IRIS"])
+    com = pd.Categorical(iris["COM"], categories=communes).codes.astype(np.int32)
+    counts = np.bincount(com, minlength=len(communes))
+    starts = np.cumsum(counts) - counts
+
+    weights = np.ones(len(iris))
+    if population is not None:
+        weights = population.reindex(iris["IRIS"]).fillna(0.0).to_numpy(dtype=np.float64)
+    totals = np.bincount(com, weights=weights, minlength=len(communes))
+    weights = np.where(totals[com] > 0, weights, 1.0)
+    totals = np.bincount(com, weights=weights, minlength=len(communes))
+    # Cumulative share of each cell within its arrondissement, offset by the arrondissement position
+    cumulative = pd.Series(weights / totals[com]).groupby(com).cumsum().to_numpy(copy=True)
+    cumulative[(starts + counts - 1)[counts > 0]] = 1.0
+
+    return {
+        "iris": pd.Index(iris["IRIS"].to_numpy()),
+        "communes": communes,
+        "com": com,
+        "income": iris[INCOME_COLUMN].to_numpy(dtype=np.float64),
+        "deciles": iris[DECILE_COLUMNS].to_numpy(dtype=np.float64),
+        "starts": starts,
+        "counts": counts,
+        "keys": com + cumulative,
+    }
+
+
+def assign_iris(customer_com, index, customer_iris=None, seed=IRIS_SEED):
+    """IRIS cell of every customer (-1 when none applies), as int32 positions in ``index``."""
+    if customer_iris is not None:
+        return index["iris"].get_indexer(pd.Index(customer_iris).astype(str)).astype(np.int32)
+
+    group = pd.Categorical(customer_com, categories=index["communes"]).codes
+    has_cells = np.zeros(len(group), dtype=bool)
+    has_cells[group >= 0] = index["counts"][group[group >= 0]] > 0
+    group = np.where(has_cells, group, 0)
+
+    draws = np.random.default_rng(seed).random(len(group))
+    cells = np.searchsorted(index["keys"], group + draws, side="right")
+    # group + draw can round up to the next integer: keep the cell inside its arrondissement
+    np.minimum(cells, index["starts"][group] + index["counts"][group] - 1, out=cells)
+    return np.where(has_cells, cells, -1).astype(np.int32)
+
+
+def cell_income(cells, index, out=None):
+    """Median disposable income of each customer's cell; NaN for customers without a cell."""
+    income = np.append(index["income"], np.nan)
+    return np.take(income, cells, out=out)
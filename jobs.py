@@ -0,0 +1,87 @@
+"""Background jobs for the long computations of the pages.
+
+A job runs on a process-wide thread pool, so the Streamlit script thread
+returns at once and the page stays responsive. The job handle is a plain dict
+kept in session state: the page polls its status and progress, and can ask it
+to stop. The job function receives a ``report(done, total, partial)`` callback
+to publish its progress; once cancellation is requested the callback raises
+``Cancelled``, so a job stops at its next report. Until then its status is
+"cancelling": it still holds its thread.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Jobs running at once in the process (all sessions); later ones wait in the queue
+JOB_THREADS = int(os.environ.get("SIMULATION_JOB_THREADS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix="simulation-job")
+
+
+class Cancelled(Exception):
+    """Raised inside a job whose cancellation was requested."""
+
+
+def _handle(key, future):
+    return {
+        "key": key,
+        "future": future,
+        "cancel": threading.Event(),
+        "progress": {"done": 0, "total": None, "partial": None},
+        "started": time.monotonic(),
+        "cached": False,
+    }
+
+
+def submit(key, func, *args, **kwargs):
+    """Run ``func(*args, report=..., **kwargs)`` in the background; returns the job handle.
+
+    ``key`` identifies the inputs of the job, so the page can tell a job of its
+    current inputs from a stale one.
+    """
+    job = _handle(key, None)
+
+    def report(done, total, partial=None):
+        if job["cancel"].is_set():
+            raise Cancelled()
+        job["progress"] = {"done": done, "total": total, "partial": partial}
+
+    def run():
+        if job["cancel"].is_set():
+            raise Cancelled()
+        return func(*args, report=report, **kwargs)
+
+    job["future"] = _executor.submit(run)
+    return job
+
+
+def finished(key, result):
+    """Handle of a job whose result is already known (e.g. from the result cache)."""
+    future = Future()
+    future.set_result(result)
+    job = _handle(key, future)
+    job["cached"] = True
+    return job
+
+
+def cancel(job):
+    """Ask ``job`` to stop: a queued job never starts, a running one stops at its next progress report."""
+    job["cancel"].set()
+    job["future"].cancel()
+
+
+def status(job):
+    """One of "queued", "running", "cancelling", "done", "cancelled" and "failed"."""
+    future = job["future"]
+    if future.cancelled():
+        return "cancelled"
+    if not future.done():
+        return "cancelling" if job["cancel"].is_set() else ("running" if future.running() else "queued")
+    if future.exception() is not None:
+        return "cancelled" if isinstance(future.exception(), Cancelled) else "failed"
+    return "done"
+
+
+def elapsed(job):
+    return time.monotonic() - job["started"]
@@ -0,0 +1,48 @@
+"""Choropleth maps drawn from one simplified GeoJSON payload per process.
+
+The arrondissement polygons are simplified with their shared borders kept
+intact, rounded to ~1 m and converted to GeoJSON once (see
+``sources.build_base_data``). Every map references the features by id
+instead of re-serializing the full-resolution shapefile geometry.
+"""
+import numpy as np
+import plotly.express as px
+import shapely
+
+SIMPLIFY_TOLERANCE = 1e-4  # degrees, roughly 10 m
+COORDINATE_DECIMALS = 5
+
+
+def simplified_geojson(map_df, id_column="insee", tolerance=SIMPLIFY_TOLERANCE):
+    """GeoJSON FeatureCollection of ``map_df`` in WGS84, with features keyed by ``id_column``."""
+    if map_df.crs is not None and map_df.crs.to_epsg() != 4326:
+        map_df = map_df.to_crs(4326)
+    geometries = map_df.geometry.values
+    if hasattr(shapely, "coverage_simplify"):
+        # Simplifies the polygons as a coverage: neighbouring arrondissements keep a common border
+        geometries = shapely.coverage_simplify(geometries, tolerance)
+    else:
+        geometries = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    geometries = shapely.transform(geometries, lambda coords: np.round(coords, COORDINATE_DECIMALS))
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "id": str(code), "properties": {}, "geometry": shapely.geometry.mapping(geom)}
+            for code, geom in zip(map_df[id_column], geometries)
+        ],
+    }
+
+
+def choropleth(df, geojson, color, locations="insee", **kwargs):
+    """Mercator choropleth of ``df`` whose ``locations`` column holds the feature ids."""
+    fig = px.choropleth(
+        df,
+        geojson=geojson,
+        locations=locations,
+        featureidkey="id",
+        color=color,
+        projection="mercator",
+        **kwargs,
+    )
+    fig.update_geos(fitbounds="locations", visible=True)
+    return fig
@@ -0,0 +1,93 @@
+"""Per-arrondissement aggregates and allocation result metrics.
+
+The customer table is reduced once per data version to an arrondissement index
+(customer counts and sums of the additive columns). Everything the Dashboard
+shows after an allocation is then plain arithmetic on that small index.
+"""
+import numpy as np
+import pandas as pd
+
+INDEX_SUM_COLUMNS = ["patrimoine", "expected_loss", "model_premium", "prob"]
+
+
+def build_arr_index(customers):
+    """Customer count and column sums per COM, accumulated in float64."""
+    codes, uniques = pd.factorize(customers["COM"], sort=True)
+    n_groups = len(uniques)
+    index = pd.DataFrame(
+        {"customers": np.bincount(codes, minlength=n_groups)},
+        index=pd.Index(np.asarray(uniques).astype(str), name="COM"),
+    )
+    for col in INDEX_SUM_COLUMNS:
+        weights = customers[col].to_numpy(dtype=np.float64)
+        index[col] = np.bincount(codes, weights=weights, minlength=n_groups)
+    return index
+
+
+def allocation_results(arr_index, allocation, names):
+    """Resulting metrics by arrondissement for an allocation (Series indexed by code).
+
+    Only arrondissements that have customers are returned, in ``allocation`` order.
+    """
+    idx = arr_index.reindex(allocation.index)
+    counts = idx["customers"].fillna(0).to_numpy()
+    has_customers = counts > 0
+
+    alloc = allocation.to_numpy(dtype=np.float64)[has_customers]
+    counts = counts[has_customers]
+    current_premium = idx["model_premium"].to_numpy()[has_customers]
+    expected_loss = idx["expected_loss"].to_numpy()[has_customers]
+    codes = allocation.index[has_customers]
+
+    avg_current_premium = current_premium / counts
+    new_premium = current_premium + alloc
+    profit = new_premium - expected_loss
+    with np.errstate(divide="ignore", invalid="ignore"):
+        profit_margin = np.where(new_premium > 0, profit / new_premium * 100, 0.0)
+
+    return pd.DataFrame({
+        'Arrondissement Code': codes,
+        'Arrondissement': [names.get(arr, f"Arr {arr}") for arr in codes],
+        'Allocation (€)': alloc,
+        'Current Premium (€)': current_premium,
+        'Avg Current Premium (€)': avg_current_premium,
+        'New Premium (€)': new_premium,
+        'Avg New Premium (€)': avg_current_premium + alloc / counts,
+        'Expected Loss (€)': expected_loss,
+        'Profit (€)': profit,
+        'Profit Margin (%)': profit_margin,
+        'Customers': counts.astype(int),
+    })
+
+
+TOTAL_COLUMNS = ["Allocation (€)", "Current Premium (€)", "New Premium (€)", "Expected Loss (€)", "Profit (€)", "Customers"]
+
+
+def update_allocation_results(state, arr_index, allocation, names, version):
+    """Keep ``state`` (a dict, e.g. in session state) in step with ``allocation``.
+
+    The first call, or a call with another data version or set of
+    arrondissements, computes every row. Later calls recompute only the rows
+    whose allocation changed and adjust the portfolio totals by the difference.
+    Returns the codes of the recomputed rows (empty when nothing changed).
+    """
+    previous = state.get("allocation")
+    if state.get("version") != version or previous is None or not previous.index.equals(allocation.index):
+        results = allocation_results(arr_index, allocation, names)
+        state.update(
+            version=version,
+            allocation=allocation.copy(),
+            results=results.set_index("Arrondissement Code", drop=False),
+            totals=results[TOTAL_COLUMNS].sum(),
+        )
+        return allocation.index
+
+    changed = allocation.index[allocation.to_numpy() != previous.to_numpy()]
+    if len(changed):
+        rows = allocation_results(arr_index, allocation[changed], names).set_index("Arrondissement Code", drop=False)
+        results = state["results"]
+        # Arrondissements without customers have no row and do not count in the totals
+        state["totals"] += rows[TOTAL_COLUMNS].sum() - results.loc[rows.index, TOTAL_COLUMNS].sum()
+        results.loc[rows.index, rows.columns] = rows
+        state["allocation"] = allocation.copy()
+    return changed
@@ -1,93 +1,139 @@
 import streamlit as st
-import pandas as pd
-import geopandas as gpd
+
+from data_store import ensure_data_loaded
+from profiling import begin_rerun, render_panel, stage
+from table_view import column_summary, filter_mask, matching_positions, page_slice, sort_order
 
 st.set_page_config(layout="wide", page_title="Raw Data")
 
+PAGE_SIZES = [25, 50, 100, 500]
+UNSORTED = "(file order)"
+
+
+# Cached per data version: the tables are read-only, so their hash is skipped (leading underscore)
+@st.cache_resource(max_entries=16)
+def cached_sort_order(version, table, column, descending, _df):
+    return sort_order(_df[column], ascending=not descending)
+
+
+@st.cache_data(max_entries=8)
+def cached_summary(version, table, _df):
+    return column_summary(_df)
+
+
+@st.cache_data(max_entries=32)
+def cached_values(version, table, column, _df):
+    return _df[column].dropna().drop_duplicates().sort_values().tolist()
+
+
+def table_explorer(table, df, version):
+    """Filter, sort and page ``df`` on the server; only the visible page is sent to the browser."""
+    with stage("column summary"):
+        summary = cached_summary(version, table, df)
+    with st.expander("Filter and sort", expanded=False):
+        filter_cols = st.multiselect("Filter columns", df.columns.tolist(), key=f"{table}_filter_cols")
+        filters = {}
+        numeric = summary["min"].notna() if "min" in summary.columns else summary["dtype"].isna()
+        for col in filter_cols:
+            if numeric[col]:
+                low, high = float(summary.at[col, "min"]), float(summary.at[col, "max"])
+                if low < high:
+                    filters[col] = st.slider(col, low, high, (low, high), key=f"{table}_range_{col}")
+            else:
+                filters[col] = st.multiselect(col, cached_values(version, table, col, df), key=f"{table}_values_{col}")
+        # An empty value selection means "no filter on this column"
+        filters = {col: condition for col, condition in filters.items() if len(condition)}
+
+        sort_col1, sort_col2 = st.columns([3, 1])
+        with sort_col1:
+            sort_by = st.selectbox("Sort by", [UNSORTED] + df.columns.tolist(), key=f"{table}_sort_by")
+        with sort_col2:
+            descending = st.checkbox("Descending", key=f"{table}_descending")
+
+    with stage("filter and sort"):
+        order = None if sort_by == UNSORTED else cached_sort_order(version, table, sort_by, descending, df)
+        positions = matching_positions(filter_mask(df, filters), order)
+
+    page_col1, page_col2 = st.columns([1, 3])
+    with page_col1:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{table}_page_size")
+    n_pages = max(1, -(-len(positions) // page_size))
+    with page_col2:
+        page = int(st.number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages, value=1, key=f"{table}_page"))
+    shown = page_slice(positions, min(page, n_pages), page_size)
+
+    if len(shown):
+        first = (min(page, n_pages) - 1) * page_size + 1
+        st.caption(f"Rows {first:,}–{first + len(shown) - 1:,} of {len(positions):,} matching ({len(df):,} in total)")
+    else:
+        st.caption(f"No matching rows ({len(df):,} in total)")
+    with stage("render page"):
+        st.dataframe(df.iloc[shown], use_container_width=True)
+    return summary
+
+
+begin_rerun("Raw Data")
+
 st.title("📊 Raw Data")
 
 st.write("This page displays the raw dataframes used in the dashboard.")
 
-# Load data if not in session state
-if "data" not in st.session_state or "customers" not in st.session_state:
-    st.info("Loading data... Please go to the Dashboard page first to load the data.")
-    
-    # Load data
-    map_df = gpd.read_file("./arrondissements_municipaux/arrondissements_municipaux-20180711.shp")
-    map_df = map_df[map_df['insee'].isin(['75101','75102','75103','75104','75105','75106',
-                '75107','75108','75109','75110','75111','75112','75113',
-                '75114','75115','75116','75117','75118','75119','75120'])]
-    
-    city_exposure = pd.read_csv("city_exposure.csv")
-    city_exposure["COM"] = city_exposure["COM"].astype(str)
-    
-    customers = pd.read_csv("customers.csv")
-    customers["COM"] = customers["COM"].astype(str)
-    
-    filosofi_filtered = pd.read_csv("filosofi_filtered.csv")
-    filosofi_filtered["insee"] = filosofi_filtered["COM"].astype(str)
-    filosofi_filtered = filosofi_filtered.drop(columns=["COM"])
-    
-    map_data = map_df.merge(city_exposure, left_on="insee", right_on="COM", how="left")
-    map_data = map_data.merge(filosofi_filtered, on="insee", how="left")
-    
-    st.session_state.data = map_data
-    st.session_state.customers = customers
+with stage("load data"):
+    shared = ensure_data_loaded()
+version = st.session_state.data_version
+customers = st.session_state.customers
+# Dropping the geometry keeps the map attributes only (the polygons are shown on the maps)
+map_data_display = shared["data"].drop(columns=["geometry"], errors="ignore")
 
 # Display Customers Data
 st.header("👥 Customers Data")
-st.write(f"**Total rows:** {len(st.session_state.customers):,}")
-st.write(f"**Columns:** {', '.join(st.session_state.customers.columns.tolist())}")
-st.dataframe(st.session_state.customers, use_container_width=True, height=400)
+st.write(f"**Columns:** {', '.join(customers.columns.tolist())}")
+customer_summary = table_explorer("customers", customers, version)
 
 # Display Map Data (without geometry column for display)
 st.header("🗺️ Map Data (Geographic + Exposure + Filosofi)")
-st.write(f"**Total rows:** {len(st.session_state.data):,}")
-st.write(f"**Columns:** {', '.join([col for col in st.session_state.data.columns if col != 'geometry'])}")
-
-# Create a copy without geometry for display
-map_data_display = st.session_state.data.drop(columns=['geometry']) if 'geometry' in st.session_state.data.columns else st.session_state.data.copy()
-st.dataframe(map_data_display, use_container_width=True, height=400)
+st.write(f"**Columns:** {', '.join(map_data_display.columns.tolist())}")
+map_summary = table_explorer("map", map_data_display, version)
 
 # Display City Exposure Data
 st.header("🏙️ City Exposure Data")
-try:
-    city_exposure = pd.read_csv("city_exposure.csv")
-    st.write(f"**Total rows:** {len(city_exposure):,}")
-    st.write(f"**Columns:** {', '.join(city_exposure.columns.tolist())}")
-    st.dataframe(city_exposure, use_container_width=True, height=400)
-except Exception as e:
-    st.error(f"Error loading city_exposure.csv: {e}")
+city_exposure = shared["city_exposure"]
+st.write(f"**Columns:** {', '.join(city_exposure.columns.tolist())}")
+table_explorer("city_exposure", city_exposure, version)
 
 # Display Filosofi Filtered Data
 st.header("💰 Filosofi Filtered Data")
-try:
-    filosofi_filtered = pd.read_csv("filosofi_filtered.csv")
-    st.write(f"**Total rows:** {len(filosofi_filtered):,}")
-    st.write(f"**Columns:** {', '.join(filosofi_filtered.columns.tolist())}")
-    st.dataframe(filosofi_filtered, use_container_width=True, height=400)
-except Exception as e:
-    st.error(f"Error loading filosofi_filtered.csv: {e}")
-
-# Data Summary
+filosofi_filtered = shared["filosofi"]
+st.write(f"**Columns:** {', '.join(filosofi_filtered.columns.tolist())}")
+table_explorer("filosofi", filosofi_filtered, version)
+
+# Data Summary (computed once per data version)
 st.header("📈 Data Summary")
 summary_col1, summary_col2 = st.columns(2)
 
 with summary_col1:
     st.subheader("Customers Data Summary")
-    st.write(f"- Total customers: {len(st.session_state.customers):,}")
-    if 'COM' in st.session_state.customers.columns:
-        st.write(f"- Unique arrondissements: {st.session_state.customers['COM'].nunique()}")
-    if 'patrimoine' in st.session_state.customers.columns:
-        st.write(f"- Total insured amount: €{st.session_state.customers['patrimoine'].sum():,.2f}")
-    if 'model_premium' in st.session_state.customers.columns:
-        st.write(f"- Total premiums: €{st.session_state.customers['model_premium'].sum():,.2f}")
+    st.write(f"- Total customers: {len(customers):,}")
+    if 'COM' in customer_summary.index:
+        st.write(f"- Unique arrondissements: {customer_summary.at['COM', 'distinct']}")
+    if 'patrimoine' in customer_summary.index:
+        st.write(f"- Total insured amount: €{customer_summary.at['patrimoine', 'sum']:,.2f}")
+    if 'model_premium' in customer_summary.index:
+        st.write(f"- Total premiums: €{customer_summary.at['model_premium', 'sum']:,.2f}")
 
 with summary_col2:
     st.subheader("Map Data Summary")
-    st.write(f"- Total geographic features: {len(st.session_state.data):,}")
-    if 'insee' in st.session_state.data.columns:
-        st.write(f"- Unique arrondissements: {st.session_state.data['insee'].nunique()}")
-    if 'patrimoine' in st.session_state.data.columns:
-        st.write(f"- Total exposure: €{st.session_state.data['patrimoine'].sum():,.2f}")
+    st.write(f"- Total geographic features: {len(map_data_display):,}")
+    if 'insee' in map_summary.index:
+        st.write(f"- Unique arrondissements: {map_summary.at['insee', 'distinct']}")
+    if 'patrimoine' in map_summary.index:
+        st.write(f"- Total exposure: €{map_summary.at['patrimoine', 'sum']:,.2f}")
+
+st.subheader("Column Statistics")
+stats_tab1, stats_tab2 = st.tabs(["Customers", "Map Data"])
+with stats_tab1:
+    st.dataframe(customer_summary, use_container_width=True)
+with stats_tab2:
+    st.dataframe(map_summary, use_container_width=True)
 
+render_panel()
@@ -1,93 +1,107 @@
+import os
+
 import streamlit as st
 import pandas as pd
-import geopandas as gpd
 import numpy as np
 import plotly.express as px
 
+from allocation import SPLIT_MODES, STRATEGIES, allocate, strategy_weights
+from churn import (
+    BASE_CHURN,
+    BURDEN_FOCUS,
+    CHURN_SENSITIVITY,
+    DEFAULT_PARAMS,
+    INCOME_THRESHOLD,
+    PARALLEL_MIN_ELEMENTS,
+    PATRIMOINE_THRESHOLD,
+    SAMPLERS,
+    SIM_SEED,
+    SOBOL_RANDOMIZATIONS,
+    paired_difference,
+    parameter_sweep,
+    premium_ratios,
+    sobol_replications,
+    summarize,
+)
+from data_store import ensure_data_loaded
+from maps import choropleth
+from optimizer import optimize_allocation
+from profiling import begin_rerun, profiled, render_panel, stage
+import jobs
+import result_cache
+import scenarios
+from scenarios import (
+    DEFAULT_SPLIT,
+    INCOME_INPUTS,
+    INCOME_LEVELS,
+    SIMULATION_MODES,
+    build_context,
+    customer_premium,
+    split_shares,
+)
+
 st.set_page_config(layout="wide", page_title="Simulation - Customer Churn")
 
 TITLE = "🎲 Simulation: Customer Churn After Allocation"
 TARGET_DEFAULT = 2_000_000.0
+# Monte Carlo sampler labels (see churn.SAMPLERS)
+SAMPLER_LABELS = dict(zip(("Independent draws", "Antithetic variates", "Sobol (randomized quasi-Monte Carlo)"), SAMPLERS))
+# Seconds between two refreshes of a running simulation's progress
+PROGRESS_INTERVAL = 0.5
 
-# Fixed simulation parameters (intentionally strict to highlight sensitivity)
-SIM_SEED = 123
-CHURN_SENSITIVITY = 1.6
-BURDEN_FOCUS = 0.8  # closer to 1 => income-driven churn
-BASE_CHURN = 0.12
-INCOME_THRESHOLD = 0.05  # lower threshold => higher sensitivity
-PATRIMOINE_THRESHOLD = 0.01
 
+@st.cache_resource(max_entries=1)
+def scenario_context(version, _shared):
+    return build_context(_shared)
 
-@st.cache_data(show_spinner=False)
-def load_map():
-    map_df = gpd.read_file("./arrondissements_municipaux/arrondissements_municipaux-20180711.shp")
-    map_df = map_df[map_df["insee"].isin(
-        [
-            "75101",
-            "75102",
-            "75103",
-            "75104",
-            "75105",
-            "75106",
-            "75107",
-            "75108",
-            "75109",
-            "75110",
-            "75111",
-            "75112",
-            "75113",
-            "75114",
-            "75115",
-            "75116",
-            "75117",
-            "75118",
-            "75119",
-            "75120",
-        ]
-    )]
-    return map_df
 
+begin_rerun("Simulation")
 
-def ensure_data_loaded():
-    """Make sure base data is available in session state."""
-    if "data" not in st.session_state or "customers" not in st.session_state:
-        map_df = load_map()
+with stage("load data"):
+    shared = ensure_data_loaded()
+arr_index = shared["arr_index"]
+geojson = shared["geojson"]
+iris_index = shared["iris_index"]
+# Per-customer arrays and per-arrondissement tables shared with the batch evaluator
+context = scenario_context(st.session_state.data_version, shared)
+# Read-only: per-customer results live in session buffers, never as columns of the shared table
+customers = st.session_state.customers
+map_data = st.session_state.data
 
-        city_exposure = pd.read_csv("city_exposure.csv")
-        city_exposure["COM"] = city_exposure["COM"].astype(str)
+arrondissements_list = context["codes"]
+arrondissements_names = context["names"]
+arr_data = context["arr_data"]
 
-        customers = pd.read_csv("customers.csv")
-        customers["COM"] = customers["COM"].astype(str)
-        st.session_state.customers = customers
+target = st.session_state.get("target_profit_costs", TARGET_DEFAULT)
 
-        filosofi_filtered = pd.read_csv("filosofi_filtered.csv")
-        filosofi_filtered["insee"] = filosofi_filtered["COM"].astype(str)
-        filosofi_filtered = filosofi_filtered.drop(columns=["COM"])
+if "simulation_allocations" not in st.session_state:
+    st.session_state.simulation_allocations = {arr: 0.0 for arr in arrondissements_list}
 
-        map_data = map_df.merge(city_exposure, left_on="insee", right_on="COM", how="left")
-        map_data = map_data.merge(filosofi_filtered, on="insee", how="left")
-        st.session_state.data = map_data
+group_codes = context["group_codes"]
 
 
-ensure_data_loaded()
-customers = st.session_state.customers.copy()
-map_data = st.session_state.data.copy()
-customers["COM"] = customers["COM"].astype(str)
-map_data["insee"] = map_data["insee"].astype(str)
+def session_buffer(name):
+    """Per-customer float64 work array reused across reruns of this session."""
+    buffers = st.session_state.setdefault("simulation_buffers", {})
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != (len(customers),):
+        buffer = buffers[name] = np.empty(len(customers))
+    return buffer
 
-arrondissements = (
-    map_data.groupby(["insee", "nom"])
-    .first()
-    .reset_index()[["insee", "nom"]]
-    .sort_values("insee")
-)
-arrondissements_list = arrondissements["insee"].tolist()
-arrondissements_names = dict(zip(arrondissements["insee"], arrondissements["nom"]))
 
-target = st.session_state.get("target_profit_costs", TARGET_DEFAULT)
+def income_distribution():
+    """Decile table and each customer's row in it, at the granularity picked in section 2."""
+    return scenarios.income_distribution(context, st.session_state.get("income_granularity", context["income_level"]))
 
-if "simulation_allocations" not in st.session_state:
-    st.session_state.simulation_allocations = {arr: 0.0 for arr in arrondissements_list}
+
+def customer_income(out=None):
+    """Income facing each customer, at the granularity and input picked in section 2."""
+    return scenarios.customer_income(
+        context,
+        st.session_state.get("income_granularity", context["income_level"]),
+        st.session_state.get("income_input", INCOME_INPUTS[0]),
+        out=out,
+    )
 
 
 st.title(TITLE)
@@ -101,55 +115,76 @@ median revenues and the insured patrimoine.
 
 st.markdown("### 1. Configure Allocation (fixed target: €{:,.0f})".format(target))
 
-
-def apply_allocation_from_series(series):
-    total_series = series.sum()
-    if total_series <= 0:
-        return
-    for arr in arrondissements_list:
-        st.session_state.simulation_allocations[arr] = float(
-            target * (series.get(arr, 0.0) / total_series)
-        )
-
+with st.expander("🧮 Churn-aware optimizer"):
+    st.write(
+        "Find the allocation of the target that maximizes the expected profit after churn. "
+        "Optionally cap the premium increase of an arrondissement (as a % of its current premium)."
+    )
+    caps_df = st.data_editor(
+        pd.DataFrame(
+            {
+                "Arrondissement Code": arrondissements_list,
+                "Arrondissement": [arrondissements_names.get(arr, arr) for arr in arrondissements_list],
+                "Max Increase (%)": [None] * len(arrondissements_list),
+            }
+        ),
+        use_container_width=True,
+        hide_index=True,
+        disabled=["Arrondissement Code", "Arrondissement"],
+        column_config={"Max Increase (%)": st.column_config.NumberColumn(min_value=0.0, step=1.0)},
+        key="optimizer_caps",
+    )
+    if st.button("Optimize Allocation"):
+        in_scope = group_codes >= 0
+        current_premium = arr_index["model_premium"].reindex(arrondissements_list).fillna(0.0).to_numpy()
+        caps = pd.to_numeric(caps_df["Max Increase (%)"], errors="coerce").to_numpy() / 100 * current_premium
+        try:
+            with stage("optimizer"):
+                optimized, optimized_profit = optimize_allocation(
+                    group_codes[in_scope],
+                    customers["model_premium"].to_numpy()[in_scope],
+                    customer_income()[in_scope],
+                    customers["patrimoine"].to_numpy()[in_scope],
+                    customers["expected_loss"].to_numpy()[in_scope],
+                    target,
+                    len(arrondissements_list),
+                    caps=caps,
+                    shares=split_shares(context, st.session_state.get("allocation_split", DEFAULT_SPLIT))[in_scope],
+                    start=[st.session_state.simulation_allocations.get(arr, 0.0) for arr in arrondissements_list],
+                )
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.session_state.simulation_allocations.update(zip(arrondissements_list, optimized.tolist()))
+            # Show the optimized values: switch to manual mode and drop stale edits of the table
+            st.session_state.allocation_mode = "Manual"
+            st.session_state.pop("allocation_editor", None)
+            st.success(f"Optimized allocation: expected profit after churn €{optimized_profit:,.0f}")
 
 allocation_mode = st.radio(
     "Auto-fill allocation strategy",
-    (
-        "Manual",
-        "Equal Distribution",
-        "Proportional to Exposure",
-        "Proportional to Risk",
-    ),
+    ("Manual",) + tuple(STRATEGIES),
     horizontal=True,
+    key="allocation_mode",
 )
 
-if allocation_mode == "Equal Distribution":
-    equal = target / len(arrondissements_list)
-    for arr in arrondissements_list:
-        st.session_state.simulation_allocations[arr] = equal
-elif allocation_mode == "Proportional to Exposure":
-    exposure = (
-        customers.groupby("COM")["patrimoine"]
-        .sum()
-        .reindex(arrondissements_list)
-        .fillna(0.0)
-    )
-    if exposure.sum() > 0:
-        apply_allocation_from_series(exposure)
+if allocation_mode != "Manual":
+    weights = strategy_weights(allocation_mode, arr_index, arr_data, arrondissements_list)
+    if weights.sum() > 0:
+        st.session_state.simulation_allocations.update(allocate(weights, target).to_dict())
     else:
-        st.warning("Exposure data not available to auto-fill.")
-elif allocation_mode == "Proportional to Risk":
-    customers["expected_loss"] = customers["patrimoine"] * customers["prob"]
-    risk = (
-        customers.groupby("COM")["expected_loss"]
-        .sum()
-        .reindex(arrondissements_list)
-        .fillna(0.0)
-    )
-    if risk.sum() > 0:
-        apply_allocation_from_series(risk)
-    else:
-        st.warning("Risk data not available to auto-fill.")
+        st.warning(f"Data for '{allocation_mode}' not available to auto-fill.")
+
+st.radio(
+    "Split within each arrondissement",
+    list(SPLIT_MODES),
+    horizontal=True,
+    key="allocation_split",
+    help=(
+        "How an arrondissement's amount is shared among its customers: evenly, or in proportion "
+        "to each customer's patrimoine, expected loss (patrimoine × probability) or current model premium."
+    ),
+)
 
 
 allocation_df = pd.DataFrame(
@@ -201,59 +236,219 @@ st.info(
     """
 )
 
-run_simulation = st.button("Run Churn Simulation", type="primary", disabled=abs(target - total_allocated) > 1)
-
-if run_simulation:
-    st.markdown("### 3. Simulation Results")
-
-    arr_counts = customers.groupby("COM").size().reindex(arrondissements_list).fillna(0).to_dict()
-    allocation_share_per_customer = {}
-    for arr in arrondissements_list:
-        count = arr_counts.get(arr, 0)
-        allocation_share_per_customer[arr] = (
-            st.session_state.simulation_allocations.get(arr, 0.0) / count if count > 0 else 0.0
+simulation_mode = st.radio(
+    "Simulation mode",
+    SIMULATION_MODES,
+    horizontal=True,
+    help=(
+        "Monte Carlo repeats the churn draw many times and reports averages with confidence intervals. "
+        "Analytical computes exact expectations and distributions without sampling."
+    ),
+)
+st.radio(
+    "Income granularity",
+    INCOME_LEVELS,
+    index=INCOME_LEVELS.index(context["income_level"]),
+    horizontal=True,
+    key="income_granularity",
+    help=(
+        "IRIS compares each premium with the median income of the customer's IRIS neighbourhood "
+        f"({len(iris_index['iris']):,} cells); Arrondissement uses one median per arrondissement."
+    ),
+)
+st.radio(
+    "Income input",
+    INCOME_INPUTS,
+    horizontal=True,
+    key="income_input",
+    help=(
+        "Decile distribution draws each customer's income from the local D1..D9 deciles instead of "
+        "using the median. Monte Carlo and Analytical average the churn probability over that distribution."
+    ),
+)
+replications = 1
+workers = 1
+sampler = SAMPLERS[0]
+if simulation_mode == "Monte Carlo":
+    mc_col1, mc_col2 = st.columns(2)
+    with mc_col1:
+        replications = int(
+            st.number_input("Replications", min_value=10, max_value=10_000, value=1_000, step=100)
+        )
+    with mc_col2:
+        max_workers = os.cpu_count() or 1
+        # Worker processes only pay off on large runs (smaller ones always run in-process)
+        large_run = len(customers) * replications >= PARALLEL_MIN_ELEMENTS
+        workers = int(
+            st.number_input(
+                "Worker processes",
+                min_value=1,
+                max_value=max_workers,
+                value=max_workers if large_run else 1,
+                help=(
+                    "Replications are split across processes; results do not depend on this number. "
+                    f"Runs of fewer than {PARALLEL_MIN_ELEMENTS:,} draws (customers × replications) "
+                    "always run in a single process."
+                ),
+            )
+        )
+    sampler = SAMPLER_LABELS[st.radio(
+        "Variance reduction",
+        list(SAMPLER_LABELS),
+        horizontal=True,
+        help=(
+            "Antithetic variates pair every draw u with 1 - u; Sobol spreads each customer's draws evenly "
+            "over the replications. Both reach a given confidence interval with fewer replications. "
+            "Every run uses the same random numbers per customer, so the profit difference with the "
+            "previous run is measured replication by replication."
+        ),
+    )]
+    if sampler == "sobol" and sobol_replications(replications) != replications:
+        replications = sobol_replications(replications)
+        st.caption(
+            f"Sobol runs {replications:,} replications: {SOBOL_RANDOMIZATIONS} randomizations of "
+            f"{replications // SOBOL_RANDOMIZATIONS:,}, the nearest power of two."
         )
 
-    customers["allocation_share"] = customers["COM"].map(allocation_share_per_customer).fillna(0.0)
-    customers["new_premium"] = customers["model_premium"] + customers["allocation_share"]
 
-    income_map = (
-        map_data.groupby("insee")["DISP_MED18"]
-        .mean()
-        .reindex(arrondissements_list)
-        .fillna(map_data["DISP_MED18"].mean())
-        .to_dict()
-    )
+@profiled("apply allocation")
+def apply_allocation_to_customers():
+    """New premium and burden ratios of the current allocation, as per-customer arrays.
 
-    customers["median_income"] = customers["COM"].map(income_map).fillna(map_data["DISP_MED18"].mean())
-    customers["premium_income_ratio"] = customers["new_premium"] / customers["median_income"].replace(0, np.nan)
-    customers["premium_income_ratio"] = customers["premium_income_ratio"].fillna(
-        customers["new_premium"] / (customers["median_income"].replace(0, np.nan) + 1)
+    The arrays are session buffers overwritten by the next call.
+    """
+    allocations = [st.session_state.simulation_allocations.get(arr, 0.0) for arr in arrondissements_list]
+    new_premium = customer_premium(
+        context, allocations, out=session_buffer("new_premium"), split=st.session_state.allocation_split
+    )
+    median_income = customer_income(out=session_buffer("median_income"))
+    ratio_income, ratio_patrimoine = premium_ratios(
+        new_premium,
+        median_income,
+        customers["patrimoine"].to_numpy(),
+        out_income=session_buffer("ratio_income"),
+        out_patrimoine=session_buffer("ratio_patrimoine"),
     )
+    return new_premium, ratio_income, ratio_patrimoine
+
 
-    customers["premium_patrimoine_ratio"] = customers["new_premium"] / customers["patrimoine"].replace(0, np.nan)
-    customers["premium_patrimoine_ratio"] = customers["premium_patrimoine_ratio"].fillna(
-        customers["premium_income_ratio"] * 0.1
+def run_simulation_job(key, context, allocations, simulation_mode, granularity, income_input, replications, workers,
+                       sampler, split, report):
+    """Background job: simulate the scenario and store it in the result cache (no Streamlit calls here)."""
+    simulation = scenarios.simulate(
+        context, allocations, simulation_mode, granularity, income_input, replications, workers,
+        progress=report, sampler=sampler, split=split,
     )
+    result_cache.put(key, simulation)
+    return simulation
+
+
+@st.fragment(run_every=PROGRESS_INTERVAL)
+def simulation_progress(job, unit):
+    """Progress and partial estimates of the running job; hands over to a full rerun when it ends."""
+    status = jobs.status(job)
+    if status not in ("queued", "running", "cancelling"):
+        st.rerun()
+    progress = job["progress"]
+    if status == "cancelling":
+        st.info("Cancelling: the simulation stops at its next step...")
+        return
+    if status == "queued":
+        st.progress(0.0, text="Waiting for a free simulation worker...")
+    elif progress["total"]:
+        st.progress(
+            progress["done"] / progress["total"],
+            text=f"{progress['done']:,} of {progress['total']:,} {unit} ({jobs.elapsed(job):.0f} s)",
+        )
+    else:
+        st.progress(0.0, text=f"Simulating... ({jobs.elapsed(job):.0f} s)")
+
+    partial = progress["partial"]
+    if partial is not None and progress["done"] > 1:
+        stay = summarize(partial["stayers"].sum(axis=1) / len(customers), batch=partial["batch"])
+        profit = summarize(partial["realized_profit"], batch=partial["batch"])
+        partial_cols = st.columns(2)
+        with partial_cols[0]:
+            st.metric("Stay Rate so far", f"{stay['mean'] * 100:.2f}%")
+            st.caption(f"95% CI: {stay['ci_low'] * 100:.2f}% – {stay['ci_high'] * 100:.2f}%")
+        with partial_cols[1]:
+            st.metric("Realized Profit so far", f"€{profit['mean']:,.0f}")
+            st.caption(f"95% CI: €{profit['ci_low']:,.0f} – €{profit['ci_high']:,.0f}")
+    if st.button("Cancel Simulation"):
+        jobs.cancel(job)
+        st.rerun()
+
 
-    burden_income = np.clip(customers["premium_income_ratio"] / INCOME_THRESHOLD, 0, 3)
-    burden_patrimoine = np.clip(customers["premium_patrimoine_ratio"] / PATRIMOINE_THRESHOLD, 0, 3)
+run_simulation = st.button("Run Churn Simulation", type="primary", disabled=abs(target - total_allocated) > 1)
 
-    churn_prob = np.clip(
-        (
-            BASE_CHURN
-            + BURDEN_FOCUS * 0.35 * burden_income
-            + (1 - BURDEN_FOCUS) * 0.25 * burden_patrimoine
+# Identical scenarios (same allocation, settings and data) share one key in the result cache
+current_allocations = [st.session_state.simulation_allocations.get(arr, 0.0) for arr in arrondissements_list]
+simulation_key = result_cache.scenario_key(
+    "simulation",
+    pd.Series(current_allocations, index=arrondissements_list),
+    st.session_state.data_version,
+    mode=simulation_mode,
+    granularity=st.session_state.income_granularity,
+    income_input=st.session_state.income_input,
+    replications=replications if simulation_mode == "Monte Carlo" else None,
+    sampler=sampler if simulation_mode == "Monte Carlo" else None,
+    split=st.session_state.allocation_split,
+)
+job = st.session_state.get("simulation_job")
+if job is not None and job["key"] != simulation_key and jobs.status(job) in ("queued", "running"):
+    # The inputs changed: the running job can only produce stale results
+    jobs.cancel(job)
+if run_simulation and (
+    job is None or job["key"] != simulation_key or jobs.status(job) in ("cancelling", "cancelled", "failed")
+):
+    cached = result_cache.get(simulation_key)
+    if cached is not None:
+        job = jobs.finished(simulation_key, cached)
+    else:
+        job = jobs.submit(
+            simulation_key,
+            run_simulation_job,
+            simulation_key,
+            context,
+            np.array(current_allocations),
+            simulation_mode,
+            st.session_state.income_granularity,
+            st.session_state.income_input,
+            replications,
+            workers,
+            sampler,
+            st.session_state.allocation_split,
         )
-        * CHURN_SENSITIVITY,
-        0,
-        0.95,
-    )
+    st.session_state.simulation_job = job
 
-    rng = np.random.default_rng(SIM_SEED)
-    customers["stayed"] = rng.random(len(customers)) > churn_prob
+simulation = None
+if job is not None and job["key"] == simulation_key:
+    st.markdown("### 3. Simulation Results")
+    job_status = jobs.status(job)
+    if job_status in ("queued", "running", "cancelling"):
+        simulation_progress(job, "replications" if simulation_mode == "Monte Carlo" else "arrondissements")
+    elif job_status == "cancelled":
+        st.warning("Simulation cancelled. Run it again to restart it.")
+    elif job_status == "failed":
+        st.error(f"Simulation failed: {job['future'].exception()}")
+    else:
+        simulation = job["future"].result()
+        if job["cached"]:
+            st.caption("⚡ Same scenario as an earlier run: results served from the scenario cache.")
+
+if simulation is not None:
+    customers_staying = simulation["customers_staying"]
+    premium_staying = simulation["premium_staying"]
+    expected_loss_staying = simulation["expected_loss_staying"]
+    exact = simulation.get("exact")
+    mc_result, mc_summary = simulation.get("mc_result"), simulation.get("mc_summary")
+
+    # One group code per arrondissement present in the portfolio
+    com_codes, com_labels = context["com_codes"], context["com_labels"]
+    original_customers = np.bincount(com_codes, minlength=len(com_labels))
+    realized_profit = premium_staying - expected_loss_staying
 
-    stayed_rate = customers["stayed"].mean()
+    stayed_rate = customers_staying.sum() / original_customers.sum()
     churn_rate = 1 - stayed_rate
 
     metric_col1, metric_col2 = st.columns(2)
@@ -262,13 +457,12 @@ if run_simulation:
     with metric_col2:
         st.metric("Customers Churning", f"{churn_rate * 100:.1f}%")
 
-    stay_summary = (
-        customers.groupby("COM")
-        .agg(
-            original_customers=("stayed", "count"),
-            customers_staying=("stayed", "sum"),
-        )
-        .reset_index()
+    stay_summary = pd.DataFrame(
+        {
+            "COM": com_labels,
+            "original_customers": original_customers,
+            "customers_staying": customers_staying,
+        }
     )
     stay_summary["customers_churned"] = stay_summary["original_customers"] - stay_summary["customers_staying"]
     stay_summary["stay_rate_%"] = (
@@ -283,8 +477,8 @@ if run_simulation:
     stay_summary["Arrondissement"] = stay_summary["COM"].map(arrondissements_names)
 
     st.subheader("Geographic Distribution Shift (Maps)")
-    if "geometry" in map_data.columns:
-        map_geo = map_data.copy()
+    if geojson["features"]:
+        map_geo = map_data.drop(columns="geometry")
         old_share_map = stay_summary.set_index("COM")["old_share_%"].to_dict()
         new_share_map = stay_summary.set_index("COM")["new_share_%"].to_dict()
 
@@ -292,51 +486,43 @@ if run_simulation:
         map_geo["new_share"] = map_geo["insee"].map(new_share_map).fillna(0.0)
         map_geo["share_diff"] = map_geo["new_share"] - map_geo["old_share"]
 
-        map_col1, map_col2 = st.columns(2)
-        with map_col1:
-            fig_old = px.choropleth(
+        with stage("churn maps"):
+            map_col1, map_col2 = st.columns(2)
+            with map_col1:
+                fig_old = choropleth(
+                    map_geo,
+                    geojson,
+                    color="old_share",
+                    labels={"old_share": "Old Share (%)"},
+                    title="Before Churn",
+                    color_continuous_scale="Blues",
+                )
+                st.plotly_chart(fig_old, use_container_width=True)
+
+            with map_col2:
+                fig_new = choropleth(
+                    map_geo,
+                    geojson,
+                    color="new_share",
+                    labels={"new_share": "New Share (%)"},
+                    title="After Churn",
+                    color_continuous_scale="Greens",
+                )
+                st.plotly_chart(fig_new, use_container_width=True)
+
+            max_abs_diff = float(map_geo["share_diff"].abs().max())
+            diff_range = max_abs_diff if max_abs_diff > 0 else 1.0
+
+            fig_diff = choropleth(
                 map_geo,
-                geojson=map_geo.geometry,
-                locations=map_geo.index,
-                color="old_share",
-                projection="mercator",
-                labels={"old_share": "Old Share (%)"},
-                title="Before Churn",
-                color_continuous_scale="Blues",
+                geojson,
+                color="share_diff",
+                labels={"share_diff": "Δ Share (pp)"},
+                title="Difference (After - Before)",
+                color_continuous_scale="RdBu",
+                range_color=(-diff_range, diff_range),
             )
-            fig_old.update_geos(fitbounds="locations", visible=True)
-            st.plotly_chart(fig_old, use_container_width=True)
-
-        with map_col2:
-            fig_new = px.choropleth(
-                map_geo,
-                geojson=map_geo.geometry,
-                locations=map_geo.index,
-                color="new_share",
-                projection="mercator",
-                labels={"new_share": "New Share (%)"},
-                title="After Churn",
-                color_continuous_scale="Greens",
-            )
-            fig_new.update_geos(fitbounds="locations", visible=True)
-            st.plotly_chart(fig_new, use_container_width=True)
-
-        max_abs_diff = float(map_geo["share_diff"].abs().max())
-        diff_range = max_abs_diff if max_abs_diff > 0 else 1.0
-
-        fig_diff = px.choropleth(
-            map_geo,
-            geojson=map_geo.geometry,
-            locations=map_geo.index,
-            color="share_diff",
-            projection="mercator",
-            labels={"share_diff": "Δ Share (pp)"},
-            title="Difference (After - Before)",
-            color_continuous_scale="RdBu",
-            range_color=(-diff_range, diff_range),
-        )
-        fig_diff.update_geos(fitbounds="locations", visible=True)
-        st.plotly_chart(fig_diff, use_container_width=True)
+            st.plotly_chart(fig_diff, use_container_width=True)
     else:
         st.warning("No geometry available to draw the geographic maps.")
 
@@ -370,13 +556,6 @@ if run_simulation:
     st.dataframe(loss_table.rename(columns={"COM": "Arrondissement Code"}), use_container_width=True, hide_index=True)
 
     st.subheader("Real Profit After Churn")
-    staying_mask = customers["stayed"]
-    premium_staying = customers.loc[staying_mask, "new_premium"].sum()
-    expected_loss_staying = (
-        customers.loc[staying_mask, "patrimoine"] * customers.loc[staying_mask, "prob"]
-    ).sum()
-    realized_profit = premium_staying - expected_loss_staying
-
     profit_cols = st.columns(3)
     with profit_cols[0]:
         st.metric("Premium Collected (Post-Churn)", f"€{premium_staying:,.0f}")
@@ -385,9 +564,155 @@ if run_simulation:
     with profit_cols[2]:
         st.metric("Realized Profit", f"€{realized_profit:,.0f}")
 
+    if simulation_mode == "Monte Carlo":
+        st.subheader(f"Monte Carlo Uncertainty ({replications:,} replications)")
+        stay = mc_summary["stay_rate"]
+        profit = mc_summary["realized_profit"]
+        mc_cols = st.columns(3)
+        with mc_cols[0]:
+            st.metric("Stay Rate (95% CI of mean)", f"{stay['mean'] * 100:.2f}%")
+            st.caption(f"CI: {stay['ci_low'] * 100:.2f}% – {stay['ci_high'] * 100:.2f}%")
+        with mc_cols[1]:
+            st.metric("Realized Profit (95% CI of mean)", f"€{profit['mean']:,.0f}")
+            st.caption(f"CI: €{profit['ci_low']:,.0f} – €{profit['ci_high']:,.0f}")
+        with mc_cols[2]:
+            st.metric("Realized Profit (median)", f"€{profit['p50']:,.0f}")
+            st.caption(f"5th – 95th percentile: €{profit['p5']:,.0f} – €{profit['p95']:,.0f}")
+
+        # The last two Monte Carlo runs are kept: with common random numbers their difference is measured
+        # replication by replication, far more precisely than by comparing the two confidence intervals
+        last_run = st.session_state.get("mc_last_run")
+        if last_run is None or last_run["key"] != simulation_key:
+            st.session_state.mc_previous_run = last_run
+            st.session_state.mc_last_run = {
+                "key": simulation_key,
+                "setup": (st.session_state.data_version, sampler, replications),
+                "result": mc_result,
+            }
+        previous_run = st.session_state.get("mc_previous_run")
+        if previous_run is not None and previous_run["setup"] == (st.session_state.data_version, sampler, replications):
+            difference = paired_difference(mc_result, previous_run["result"])
+            st.metric("Realized Profit vs Previous Run (paired)", f"€{difference['mean']:+,.0f}")
+            st.caption(
+                f"95% CI of the difference: €{difference['ci_low']:+,.0f} – €{difference['ci_high']:+,.0f} "
+                "(both runs use the same random numbers per customer)"
+            )
+
+        st.plotly_chart(
+            px.histogram(
+                pd.DataFrame({"Realized Profit (€)": mc_result["realized_profit"]}),
+                x="Realized Profit (€)",
+                nbins=50,
+                title="Realized Profit Across Replications",
+            ),
+            use_container_width=True,
+        )
+
+        group_churn = mc_summary["group_churn"][["mean", "ci_low", "ci_high", "p5", "p50", "p95"]] * 100
+        group_churn.insert(0, "Arrondissement", [arrondissements_names.get(com, com) for com in group_churn.index])
+        st.caption("Churn rate by arrondissement across replications (%)")
+        st.dataframe(
+            group_churn.rename_axis("Arrondissement Code").reset_index().round(2),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+    if simulation_mode == "Analytical (exact)":
+        st.subheader("Exact Distribution (No Sampling)")
+        stay = exact["stay_rate"]
+        profit = exact["realized_profit"]
+        exact_cols = st.columns(3)
+        with exact_cols[0]:
+            st.metric("Expected Stay Rate", f"{stay['mean'] * 100:.2f}%")
+            st.caption(f"Std: {stay['std'] * 100:.2f} pp, 5th – 95th percentile: {stay['p5'] * 100:.2f}% – {stay['p95'] * 100:.2f}%")
+        with exact_cols[1]:
+            st.metric("Expected Realized Profit", f"€{profit['mean']:,.0f}")
+            st.caption(f"Std: €{profit['std']:,.0f}")
+        with exact_cols[2]:
+            st.metric("Realized Profit (median)", f"€{profit['p50']:,.0f}")
+            st.caption(f"5th – 95th percentile: €{profit['p5']:,.0f} – €{profit['p95']:,.0f}")
+
+        group_churn = exact["group_churn"][["mean", "std", "p5", "p50", "p95"]] * 100
+        group_churn.insert(0, "Arrondissement", [arrondissements_names.get(com, com) for com in group_churn.index])
+        st.caption("Churn rate distribution by arrondissement (%)")
+        st.dataframe(
+            group_churn.rename_axis("Arrondissement Code").reset_index().round(2),
+            use_container_width=True,
+            hide_index=True,
+        )
+
     st.info(
-        "The simulation uses stochastic churn draws. "
-        "Adjust the parameters or the allocation and re-run to explore different scenarios."
+        ("The results are exact expectations of the churn model. " if simulation_mode == "Analytical (exact)"
+         else "The simulation uses stochastic churn draws. ")
+        + "Adjust the parameters or the allocation and re-run to explore different scenarios."
+    )
+elif job is None or job["key"] != simulation_key:
+    st.info("Configure the allocation and parameters, then click **Run Churn Simulation**.")
+
+
+st.markdown("### 4. Parameter Sensitivity")
+SWEEP_PARAMETERS = {
+    "Churn sensitivity": "sensitivity",
+    "Income vs patrimoine weight": "burden_focus",
+    "Base churn": "base_churn",
+    "Income threshold": "income_threshold",
+    "Patrimoine threshold": "patrimoine_threshold",
+}
+with st.expander("📐 Sweep the churn model constants for the current allocation"):
+    st.write(
+        "Expected churn and profit after churn over a grid of two model constants; "
+        "the other constants keep their workshop values."
     )
-else:
-    st.info("Configure the allocation and parameters, then click **Run Churn Simulation**.")
\ No newline at end of file
+    sweep_cols = st.columns(2)
+    sweep_axes = {}
+    for sweep_col, default_label, axis in zip(
+        sweep_cols, ("Churn sensitivity", "Income threshold"), ("X axis", "Y axis")
+    ):
+        with sweep_col:
+            label = st.selectbox(axis, list(SWEEP_PARAMETERS), index=list(SWEEP_PARAMETERS).index(default_label))
+            default = DEFAULT_PARAMS[SWEEP_PARAMETERS[label]]
+            low, high = st.slider(
+                f"{label} range",
+                min_value=0.0,
+                max_value=float(default * 3),
+                value=(float(default * 0.5), float(default * 1.5)),
+                format="%.3f",
+                key=f"sweep_range_{axis}",
+            )
+            steps = st.number_input(f"{label} steps", min_value=2, max_value=50, value=15, key=f"sweep_steps_{axis}")
+            sweep_axes[label] = np.linspace(low, high, int(steps))
+
+    if len(sweep_axes) < 2:
+        st.warning("Pick two different constants for the axes.")
+    elif st.button("Run Sensitivity Sweep", disabled=abs(target - total_allocated) > 1):
+        new_premium, ratio_income, ratio_patrimoine = apply_allocation_to_customers()
+        x_label, y_label = list(sweep_axes)
+        with stage("parameter sweep"):
+            sweep = parameter_sweep(
+                ratio_income,
+                ratio_patrimoine,
+                new_premium - customers["expected_loss"].to_numpy(),
+                {SWEEP_PARAMETERS[label]: values for label, values in sweep_axes.items()},
+            )
+        heat_cols = st.columns(2)
+        for heat_col, column, title, scale in zip(
+            heat_cols,
+            ("realized_profit", "churn_rate"),
+            ("Expected Realized Profit (€)", "Expected Churn Rate"),
+            ("Greens", "Reds"),
+        ):
+            table = sweep.pivot_table(
+                index=SWEEP_PARAMETERS[y_label], columns=SWEEP_PARAMETERS[x_label], values=column
+            )
+            fig = px.imshow(
+                table,
+                origin="lower",
+                aspect="auto",
+                color_continuous_scale=scale,
+                labels={"x": x_label, "y": y_label, "color": title},
+                title=title,
+            )
+            with heat_col:
+                st.plotly_chart(fig, use_container_width=True)
+
+render_panel()
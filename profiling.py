@@ -0,0 +1,134 @@
+"""Opt-in per-rerun profiling of the pages.
+
+Pages wrap their stages in ``with stage("name"):`` (or decorate functions
+with ``@profiled("name")``), call ``begin_rerun`` first and ``render_panel``
+last. When profiling is switched on in the sidebar, every stage records its
+wall time, number of calls and resident memory delta for the current rerun,
+and the per-rerun totals are kept per page to show rolling percentiles. When
+it is off, a stage costs one dictionary lookup.
+"""
+import json
+import os
+import resource
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+ROLLING_WINDOW = 100
+PERCENTILES = (50, 90, 99)
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident memory of the process in bytes (peak resident memory where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _state():
+    return st.session_state.setdefault("profiler", {"page": None, "current": {}, "history": {}})
+
+
+def enabled():
+    return st.session_state.get("profiling_enabled", False)
+
+
+def begin_rerun(page):
+    """Start recording a rerun of ``page``."""
+    # Re-assigning keeps the sidebar toggle's value when switching pages
+    st.session_state.profiling_enabled = enabled()
+    state = _state()
+    state.update(page=page, current={}, started=time.perf_counter())
+
+
+@contextmanager
+def stage(name):
+    """Record the wall time and memory delta of the block under ``name``."""
+    if not enabled():
+        yield
+        return
+    rss = current_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = _state()["current"].setdefault(name, {"calls": 0, "seconds": 0.0, "memory_delta": 0})
+        record["calls"] += 1
+        record["seconds"] += time.perf_counter() - start
+        record["memory_delta"] += current_rss() - rss
+
+
+def profiled(name):
+    """Decorator recording every call of the function as stage ``name``."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _close_rerun(state):
+    """Push the rerun's stage totals into the rolling history of the page."""
+    state["current"]["(rerun total)"] = {
+        "calls": 1,
+        "seconds": time.perf_counter() - state["started"],
+        "memory_delta": 0,
+    }
+    history = state["history"].setdefault(state["page"], {})
+    for name, record in state["current"].items():
+        history.setdefault(name, deque(maxlen=ROLLING_WINDOW)).append(record["seconds"])
+
+
+def profile_table(state):
+    rows = []
+    history = state["history"].get(state["page"], {})
+    for name, record in state["current"].items():
+        samples = np.asarray(history.get(name, ()))
+        row = {
+            "Stage": name,
+            "Calls": record["calls"],
+            "Wall (ms)": record["seconds"] * 1000,
+            "Memory Δ (MB)": record["memory_delta"] / 2**20,
+            "Reruns": len(samples),
+        }
+        for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES) if len(samples) else [np.nan] * 3):
+            row[f"p{q} (ms)"] = value * 1000
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def render_panel():
+    """Sidebar panel with the on/off switch, this rerun's stages and a JSON export."""
+    state = _state()
+    with st.sidebar.expander("⏱️ Profiling", expanded=enabled()):
+        st.toggle("Profile reruns", key="profiling_enabled")
+        if not enabled() or not state["current"]:
+            st.caption("Switch on, then interact with the page to time its stages.")
+            return
+        _close_rerun(state)
+        table = profile_table(state)
+        st.dataframe(table.round(2), hide_index=True, use_container_width=True)
+        export = {
+            "page": state["page"],
+            "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "rerun": state["current"],
+            "summary": table.to_dict(orient="records"),
+            "history_seconds": {name: list(samples) for name, samples in state["history"][state["page"]].items()},
+        }
+        st.download_button(
+            "Export JSON",
+            json.dumps(export, indent=2, default=float),
+            file_name=f"profile-{state['page']}.json",
+            mime="application/json",
+        )
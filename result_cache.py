@@ -0,0 +1,141 @@
+"""Content-addressed cache of scenario results.
+
+A result is stored under the SHA-256 of everything it depends on: the kind of
+result, the allocation vector, the churn model constants, the seeds, the data
+version, the evaluation options and ``MODEL_VERSION``. The same scenario
+submitted twice, by the same or another session, is then answered from the
+cache.
+
+The in-process cache keeps the ``RESULT_CACHE_ENTRIES`` most recently used
+results. When ``RESULT_CACHE_DIR`` is set (``.cache/results`` by default; an
+empty value disables it), results are also pickled to that directory, which
+keeps at most ``RESULT_CACHE_DISK_ENTRIES`` files, so they survive restarts.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import churn
+import ingest
+from income import INCOME_SEED
+from iris import IRIS_SEED
+
+MEMORY_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "128"))
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", os.path.join(ingest.CACHE_DIR, "results"))
+DISK_ENTRIES = int(os.environ.get("RESULT_CACHE_DISK_ENTRIES", "1024"))
+# Version of the code computing and laying out results. Bump it whenever a change to the
+# model (churn.py, income.py, iris.py, scenarios.py, metrics.py) or to the result dicts
+# would give a different result for the same inputs: older cached results are then ignored.
+MODEL_VERSION = 1
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def model_fingerprint():
+    """Model code version, churn model constants and seeds a result depends on."""
+    return {
+        "version": MODEL_VERSION,
+        "params": churn.DEFAULT_PARAMS,
+        "burden_cap": churn.BURDEN_CAP,
+        "max_churn": churn.MAX_CHURN,
+        "seeds": [churn.SIM_SEED, INCOME_SEED, IRIS_SEED],
+        "customer_dtype": ingest.CUSTOMER_FLOAT_DTYPE,
+    }
+
+
+def scenario_key(kind, allocation, version, **options):
+    """Hex digest identifying a result of ``kind`` for ``allocation`` (a Series indexed by code)."""
+    digest = hashlib.sha256()
+    header = {"kind": kind, "codes": [str(code) for code in allocation.index], "version": version,
+              "model": model_fingerprint(), "options": options}
+    digest.update(json.dumps(header, sort_keys=True, default=str).encode())
+    digest.update(np.ascontiguousarray(allocation.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def _read_disk(key):
+    try:
+        with open(_disk_path(key), "rb") as f:
+            value = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    os.utime(_disk_path(key))  # the modification time orders the files for eviction
+    return value
+
+
+def _write_disk(key, value):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _disk_path(key))
+
+    files = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith(".pkl")]
+    if len(files) > DISK_ENTRIES:
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - DISK_ENTRIES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def get(key):
+    """Cached result of ``key``, or None."""
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            return _entries[key]
+    value = _read_disk(key) if CACHE_DIR else None
+    if value is not None:
+        _remember(key, value)
+    return value
+
+
+def _remember(key, value):
+    with _lock:
+        _entries[key] = value
+        _entries.move_to_end(key)
+        while len(_entries) > MEMORY_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def put(key, value):
+    _remember(key, value)
+    if CACHE_DIR:
+        try:
+            _write_disk(key, value)
+        except OSError:
+            pass  # persistence is best effort: the result stays cached in memory
+
+
+def cached(key, compute):
+    """Result of ``key``, computed by ``compute()`` and stored on a miss.
+
+    Cached results are shared between callers and must not be modified.
+    """
+    value = get(key)
+    if value is None:
+        value = compute()
+        put(key, value)
+    return value
+
+
+def clear(disk=False):
+    """Empty the in-process cache, and the directory too when ``disk``."""
+    with _lock:
+        _entries.clear()
+    if disk and CACHE_DIR and os.path.isdir(CACHE_DIR):
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
@@ -0,0 +1,256 @@
+"""Scenario evaluation without the user interface.
+
+A scenario is an allocation of the target over the arrondissements. Its
+evaluation gives the Dashboard's resulting metrics (new premium, expected loss,
+profit and margin) and the Simulation page's churn results, for one of the
+page's simulation modes and income settings. The pages and the batch evaluator
+(evaluate_scenarios.py) share the functions below.
+"""
+import numpy as np
+import pandas as pd
+
+import result_cache
+from allocation import SPLIT_MODES, customer_shares
+from churn import SAMPLERS, SIM_SEED, analytical_churn, churn_probability, monte_carlo_churn, premium_ratios, summarize_monte_carlo
+from income import DECILE_COLUMNS, expected_churn, sample_income
+from iris import cell_income
+from metrics import TOTAL_COLUMNS, allocation_results
+
+SIMULATION_MODES = ("Single draw", "Monte Carlo", "Analytical (exact)")
+INCOME_LEVELS = ("Arrondissement", "IRIS")
+INCOME_INPUTS = ("Median", "Decile distribution")
+DEFAULT_REPLICATIONS = 1_000
+DEFAULT_SPLIT = next(iter(SPLIT_MODES))
+
+
+def build_context(shared, version=None):
+    """Per-customer arrays and per-arrondissement tables of the shared data (see data_store).
+
+    ``version`` is the data version the results are cached under (no caching when None).
+    """
+    customers = shared["customers"]
+    map_data = shared["data"]
+    arrondissements = (
+        map_data.groupby(["insee", "nom"]).first().reset_index()[["insee", "nom"]].sort_values("insee")
+    )
+    codes = arrondissements["insee"].astype(str).tolist()
+
+    # Per-customer arrondissement position in ``codes`` (-1 outside the map): indexing a
+    # per-arrondissement array with one extra trailing slot gives the fallback to those customers
+    group_codes = pd.Categorical(customers["COM"], categories=codes).codes
+    fallback_income = map_data["DISP_MED18"].mean()
+    income = map_data.groupby("insee")["DISP_MED18"].mean().reindex(codes).fillna(fallback_income)
+    arr_deciles = map_data.groupby("insee")[DECILE_COLUMNS].mean().reindex(codes)
+    # One group code per arrondissement present in the portfolio, for the churn results
+    com_codes, com_labels = pd.factorize(customers["COM"], sort=True)
+
+    return {
+        "version": version,
+        "codes": codes,
+        "names": dict(zip(codes, arrondissements["nom"])),
+        "arr_index": shared["arr_index"],
+        "arr_data": map_data.drop(columns="geometry").groupby("insee").first(),
+        "group_codes": group_codes,
+        "group_counts": np.bincount(group_codes[group_codes >= 0], minlength=len(codes)),
+        "income_values": np.append(income.to_numpy(), fallback_income),
+        "arr_deciles": np.vstack([arr_deciles.fillna(arr_deciles.mean()).to_numpy(), arr_deciles.mean().to_numpy()]),
+        "iris_index": shared["iris_index"],
+        "iris_cells": shared["iris_cells"],
+        # IRIS incomes are only the default when the customers carry their IRIS code; otherwise
+        # their cells are drawn at random within the arrondissement (see iris.assign_iris)
+        "income_level": "IRIS" if "IRIS" in customers.columns else INCOME_LEVELS[0],
+        "customers": customers,
+        # Customer shares of their arrondissement's amount, by split mode, computed on first use
+        "shares": {},
+        "premium": customers["model_premium"].to_numpy(),
+        "patrimoine": customers["patrimoine"].to_numpy(),
+        "expected_loss": customers["expected_loss"].to_numpy(),
+        "com_codes": com_codes,
+        "com_labels": np.asarray(com_labels).astype(str),
+    }
+
+
+def income_distribution(context, granularity=INCOME_LEVELS[0]):
+    """Decile table and each customer's row in it, at ``granularity``."""
+    group_codes = context["group_codes"]
+    arr_rows = np.where(group_codes >= 0, group_codes, len(context["codes"])).astype(np.intp)
+    if granularity == "Arrondissement":
+        return context["arr_deciles"], arr_rows
+    iris_cells, iris_deciles = context["iris_cells"], context["iris_index"]["deciles"]
+    has_cell = iris_cells >= 0
+    complete = np.zeros(len(group_codes), dtype=bool)
+    complete[has_cell] = ~np.isnan(iris_deciles).any(axis=1)[iris_cells[has_cell]]
+    return np.vstack([iris_deciles, context["arr_deciles"]]), np.where(complete, iris_cells, len(iris_deciles) + arr_rows)
+
+
+def customer_income(context, granularity=INCOME_LEVELS[0], income_input=INCOME_INPUTS[0], out=None):
+    """Income facing each customer.
+
+    With the decile distribution every customer gets one income drawn from their
+    area's distribution. IRIS incomes fall back to the arrondissement where a
+    customer has no cell or the cell's income is not published.
+    """
+    if income_input == "Decile distribution":
+        income = sample_income(*income_distribution(context, granularity))
+        if out is None:
+            return income
+        out[...] = income
+        return out
+    if granularity == "Arrondissement":
+        return np.take(context["income_values"], context["group_codes"], out=out)
+    income = cell_income(context["iris_cells"], context["iris_index"], out=out)
+    missing = np.isnan(income)
+    income[missing] = context["income_values"][context["group_codes"][missing]]
+    return income
+
+
+def split_shares(context, split=DEFAULT_SPLIT):
+    """Fraction of its arrondissement's amount every customer receives under ``split`` (a key of SPLIT_MODES)."""
+    shares = context["shares"].get(split)
+    if shares is None:
+        column = SPLIT_MODES[split]
+        weights = None if column is None else context["customers"][column].to_numpy()
+        shares = context["shares"][split] = customer_shares(context["group_codes"], len(context["codes"]), weights)
+    return shares
+
+
+def customer_premium(context, allocation, out=None, split=DEFAULT_SPLIT):
+    """New premium of every customer: their share of their arrondissement's allocation plus the model premium."""
+    allocation = np.asarray(allocation, dtype=np.float64)
+    if SPLIT_MODES[split] is None:
+        group_counts = context["group_counts"]
+        per_customer = np.zeros(len(context["codes"]) + 1)
+        np.divide(allocation, group_counts, out=per_customer[:-1], where=group_counts > 0)
+        new_premium = np.take(per_customer, context["group_codes"], out=out)
+    else:
+        new_premium = np.take(np.append(allocation, 0.0), context["group_codes"], out=out)
+        new_premium *= split_shares(context, split)
+    new_premium += context["premium"]
+    return new_premium
+
+
+def scenario_churn_probability(context, new_premium, mode=SIMULATION_MODES[0],
+                               granularity=INCOME_LEVELS[0], income_input=INCOME_INPUTS[0]):
+    """Churn probability of every customer, as the Simulation page computes it for ``mode``."""
+    if income_input == "Decile distribution" and mode != "Single draw":
+        return expected_churn(new_premium, context["patrimoine"], *income_distribution(context, granularity))
+    income = customer_income(context, granularity, income_input)
+    return churn_probability(*premium_ratios(new_premium, income, context["patrimoine"]))
+
+
+def simulate(context, allocation, mode=SIMULATION_MODES[0], granularity=INCOME_LEVELS[0],
+             income_input=INCOME_INPUTS[0], replications=DEFAULT_REPLICATIONS, workers=1, progress=None,
+             sampler=SAMPLERS[0], split=DEFAULT_SPLIT):
+    """Churn results of ``allocation`` in ``mode``, as the Simulation page shows them.
+
+    Returns a dict with the expected ``customers_staying`` per portfolio
+    arrondissement (``context["com_labels"]``), ``premium_staying`` and
+    ``expected_loss_staying``, plus the engine output: ``exact`` for the
+    analytical mode, ``mc_result`` and ``mc_summary`` for Monte Carlo.
+    ``sampler`` is passed to ``monte_carlo_churn``; ``split`` is how each
+    arrondissement's amount is shared among its customers. ``progress(done,
+    total)`` is called between the stages of every mode, with ``total`` None
+    until the engine reports its own progress (replications or groups), so a
+    job can be stopped wherever it is by raising from it.
+    """
+    def checkpoint():
+        if progress is not None:
+            progress(0, None)
+
+    new_premium = customer_premium(context, allocation, split=split)
+    checkpoint()
+    churn_prob = scenario_churn_probability(context, new_premium, mode, granularity, income_input)
+    checkpoint()
+    expected_loss = context["expected_loss"]
+    com_codes, com_labels = context["com_codes"], context["com_labels"]
+    if mode == "Analytical (exact)":
+        exact = analytical_churn(
+            churn_prob, com_codes, len(com_labels), new_premium, expected_loss, com_labels, progress=progress
+        )
+        return {
+            "customers_staying": exact["stayers"],
+            "premium_staying": exact["premium"]["mean"],
+            "expected_loss_staying": exact["expected_loss"]["mean"],
+            "exact": exact,
+        }
+    if mode == "Monte Carlo":
+        mc_result = monte_carlo_churn(
+            churn_prob, com_codes, len(com_labels), new_premium, expected_loss, replications,
+            workers=workers, progress=progress, sampler=sampler,
+        )
+        mc_summary = summarize_monte_carlo(mc_result, com_labels)
+        return {
+            "customers_staying": mc_result["stayers"].mean(axis=0),
+            "premium_staying": mc_summary["premium"]["mean"],
+            "expected_loss_staying": mc_summary["expected_loss"]["mean"],
+            "mc_result": mc_result,
+            "mc_summary": mc_summary,
+        }
+    stayed = np.random.default_rng(SIM_SEED).random(len(churn_prob)) > churn_prob
+    return {
+        "customers_staying": np.bincount(com_codes[stayed], minlength=len(com_labels)),
+        "premium_staying": new_premium[stayed].sum(),
+        "expected_loss_staying": expected_loss[stayed].sum(dtype=np.float64),
+    }
+
+
+def evaluate_scenario(context, allocation, mode=SIMULATION_MODES[0], granularity=INCOME_LEVELS[0],
+                      income_input=INCOME_INPUTS[0], replications=DEFAULT_REPLICATIONS, sampler=SAMPLERS[0],
+                      split=DEFAULT_SPLIT):
+    """Dashboard and churn results of ``allocation`` (amounts in ``context["codes"]`` order) as one flat dict."""
+    codes = context["codes"]
+    allocation = pd.Series(np.asarray(allocation, dtype=np.float64), index=codes)
+    totals = allocation_results(context["arr_index"], allocation, context["names"])[TOTAL_COLUMNS].sum()
+    current_premium = context["arr_index"]["model_premium"].sum()
+    profit = totals["New Premium (€)"] - totals["Expected Loss (€)"]
+    row = {
+        "total_allocated": allocation.sum(),
+        "new_premium": totals["New Premium (€)"],
+        "expected_loss": totals["Expected Loss (€)"],
+        "profit": profit,
+        "profit_margin_pct": profit / totals["New Premium (€)"] * 100 if totals["New Premium (€)"] > 0 else 0.0,
+        "premium_increase_pct": (totals["New Premium (€)"] / current_premium - 1) * 100 if current_premium > 0 else 0.0,
+    }
+
+    simulation = simulate(
+        context, allocation.to_numpy(), mode, granularity, income_input, replications, sampler=sampler, split=split
+    )
+    stayers = simulation["customers_staying"]
+    if mode == "Analytical (exact)":
+        spread = {f"realized_profit_{key}": simulation["exact"]["realized_profit"][key] for key in ("std", "p5", "p95")}
+    elif mode == "Monte Carlo":
+        summary = simulation["mc_summary"]["realized_profit"]
+        spread = {f"realized_profit_{key}": summary[key] for key in ("std", "ci_low", "ci_high", "p5", "p95")}
+    else:
+        spread = {}
+
+    com_codes, com_labels = context["com_codes"], context["com_labels"]
+    original = np.bincount(com_codes, minlength=len(com_labels))
+    row.update(
+        stay_rate=stayers.sum() / original.sum(),
+        premium_after_churn=simulation["premium_staying"],
+        expected_loss_after_churn=simulation["expected_loss_staying"],
+        realized_profit=simulation["premium_staying"] - simulation["expected_loss_staying"],
+        **spread,
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        churn_rate = np.where(original > 0, 1 - stayers / original, 0.0)
+    row.update({f"allocation_{code}": value for code, value in allocation.items()})
+    row.update({f"churn_rate_{label}": value for label, value in zip(com_labels, churn_rate)})
+    return row
+
+
+def cached_scenario(context, allocation, mode=SIMULATION_MODES[0], granularity=INCOME_LEVELS[0],
+                    income_input=INCOME_INPUTS[0], replications=DEFAULT_REPLICATIONS, sampler=SAMPLERS[0],
+                    split=DEFAULT_SPLIT):
+    """``evaluate_scenario`` memoized in the scenario result cache (see result_cache)."""
+    options = {"mode": mode, "granularity": granularity, "income_input": income_input,
+               "replications": replications, "sampler": sampler, "split": split}
+    if context["version"] is None:
+        return evaluate_scenario(context, allocation, **options)
+    allocation = pd.Series(np.asarray(allocation, dtype=np.float64), index=context["codes"])
+    # The replication count and the sampler only change Monte Carlo results
+    monte_carlo = mode == "Monte Carlo"
+    key_options = {**options, "replications": replications if monte_carlo else None, "sampler": sampler if monte_carlo else None}
+    key = result_cache.scenario_key("scenario", allocation, context["version"], **key_options)
+    return result_cache.cached(key, lambda: evaluate_scenario(context, allocation.to_numpy(), **options))
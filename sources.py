@@ -0,0 +1,131 @@
+"""Source files of the app and the plain loaders that read and merge them.
+
+Nothing here depends on Streamlit, so the command line tools
+(evaluate_scenarios.py, benchmark.py) call these loaders directly.
+data_store.py wraps them in process-wide caches for the pages. Loaders that
+depend on the scope take its map units (see ``scope_communes``), so callers
+resolve the scope once.
+"""
+import os
+
+import pandas as pd
+
+import communes
+import ingest
+import iris
+import maps
+import metrics
+
+SHAPEFILE_PATH = "./arrondissements_municipaux/arrondissements_municipaux-20180711.shp"
+CITY_EXPOSURE_PATH = "city_exposure.csv"
+CUSTOMERS_PATH = "customers.csv"
+# Shipped income extract of Paris, used when the IRIS workbook is not available
+FILOSOFI_PATH = "filosofi_filtered.csv"
+IRIS_XLSX_PATH = "BASE_TD_FILO_DISP_IRIS_2018.xlsx"
+# Optional: when present, IRIS incomes are population-weighted in the income extract
+IRIS_POPULATION_PATH = "base-ic-evol-struct-pop-2018.csv"
+COMMUNES_PATH = "v_commune_2025.csv"
+
+# Communes covered by the app (see communes.py for the syntax); the default is Paris' 20 arrondissements
+SCOPE = os.environ.get("PRICING_SCOPE", "COM=75056")
+
+SOURCE_FILES = (SHAPEFILE_PATH, CITY_EXPOSURE_PATH, CUSTOMERS_PATH, IRIS_XLSX_PATH, COMMUNES_PATH)
+
+
+def file_signature(path):
+    """Return a cheap fingerprint of a file (modification time and size)."""
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def scope_communes():
+    """COM codes of the map units in ``SCOPE``."""
+    return communes.scope_units(communes.load_reference(COMMUNES_PATH), SCOPE)
+
+
+def refresh_derived_files(units):
+    """Path of the income extract of ``units``, rebuilt if the IRIS workbook changed (only a stat otherwise).
+
+    The extract is cached per scope under ``ingest.CACHE_DIR``; the shipped
+    filosofi_filtered.csv is only read when the workbook is not available.
+    """
+    if os.path.exists(IRIS_XLSX_PATH):
+        return ingest.build_filosofi(IRIS_XLSX_PATH, units, IRIS_POPULATION_PATH)
+    return FILOSOFI_PATH
+
+
+def data_version(units):
+    """Fingerprint of all source files; changes whenever one of them is rewritten."""
+    # The shapefile's sidecars (.dbf, .prj...) count as much as the .shp itself
+    paths = SOURCE_FILES + tuple(ingest.shapefile_parts(SHAPEFILE_PATH)) + (refresh_derived_files(units),)
+    return (SCOPE,) + tuple(file_signature(path) for path in paths)
+
+
+def load_map(units):
+    # Filtered read of the scope's features, cached as GeoParquet after the first run
+    return ingest.load_map(SHAPEFILE_PATH, units)
+
+
+def load_city_exposure():
+    city_exposure = pd.read_csv(CITY_EXPOSURE_PATH)
+    city_exposure["COM"] = city_exposure["COM"].astype(str)
+    return city_exposure
+
+
+def load_filosofi(units):
+    filosofi_filtered = pd.read_csv(refresh_derived_files(units))
+    filosofi_filtered["COM"] = filosofi_filtered["COM"].astype(str)
+    return filosofi_filtered
+
+
+def load_customers(path=CUSTOMERS_PATH):
+    # Typed, memory-mapped columnar cache of customers.csv (COM is a categorical of strings)
+    customers = ingest.load_customers(path)
+    # Precomputed once here so pages never need to add columns to the shared frame
+    customers["expected_loss"] = customers["patrimoine"] * customers["prob"]
+    return customers
+
+
+def load_iris_index(units):
+    population = ingest.load_iris_population(IRIS_POPULATION_PATH)
+    return iris.build_iris_index(ingest.load_iris(IRIS_XLSX_PATH), units, population)
+
+
+def merge_map_data(map_df, city_exposure, filosofi):
+    """Map features with their exposure aggregates and Filosofi incomes."""
+    map_data = map_df.merge(city_exposure, left_on="insee", right_on="COM", how="left")
+    return map_data.merge(filosofi.rename(columns={"COM": "insee"}), on="insee", how="left")
+
+
+def dropped_units(units, map_df, city_exposure):
+    """Scope units left out of the maps and metrics, by reason."""
+    mapped = set(map_df["insee"])
+    exposed = set(city_exposure["COM"])
+    return {
+        "no geometry": [unit for unit in units if unit not in mapped],
+        "no exposure data": [unit for unit in units if unit in mapped and unit not in exposed],
+    }
+
+
+def build_base_data(units):
+    """Read every source file and build the merged map data and the customer table."""
+    map_df = load_map(units)
+    city_exposure = load_city_exposure()
+    filosofi = load_filosofi(units)
+    map_data = merge_map_data(map_df, city_exposure, filosofi)
+
+    customers = load_customers()
+    iris_index = load_iris_index(units)
+
+    return {
+        "data": map_data,
+        "customers": customers,
+        "arr_index": metrics.build_arr_index(customers),
+        "geojson": maps.simplified_geojson(map_df),
+        "city_exposure": city_exposure,
+        "filosofi": filosofi,
+        "dropped_units": dropped_units(units, map_df, city_exposure),
+        "iris_index": iris_index,
+        # IRIS cell of every customer (row-aligned with ``customers``), drawn once per data version
+        "iris_cells": iris.assign_iris(customers["COM"], iris_index, customers.get("IRIS")),
+    }
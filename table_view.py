@@ -0,0 +1,68 @@
+"""Filtering, sorting and paging of large read-only tables on the server.
+
+The Raw Data page never hands a whole table to ``st.dataframe``: it builds a
+boolean mask from the column filters, orders the matching rows with a sort
+permutation computed once per column, direction and data version, and
+serializes only the rows of the current page.
+"""
+import numpy as np
+import pandas as pd
+
+
+def sort_order(column, ascending=True):
+    """Stable permutation of ``column`` in either direction; missing values come last."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Codes follow the (sorted) categories; missing values are -1
+        codes = column.cat.codes.to_numpy().astype(np.intp)
+    else:
+        codes, _ = pd.factorize(column, sort=True)
+    if not ascending:
+        codes = np.where(codes < 0, codes, codes.max(initial=0) - codes)
+    # Missing values are sent to the end; ties keep their file order
+    return np.argsort(np.where(codes < 0, np.iinfo(codes.dtype).max, codes), kind="stable")
+
+
+def filter_mask(df, filters):
+    """Rows of ``df`` matching every filter.
+
+    ``filters`` maps a column to either a list of accepted values or a
+    ``(low, high)`` tuple of inclusive bounds.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, condition in filters.items():
+        if isinstance(condition, tuple):
+            low, high = condition
+            values = df[col].to_numpy()
+            mask &= (values >= low) & (values <= high)
+        else:
+            mask &= df[col].isin(condition).to_numpy()
+    return mask
+
+
+def matching_positions(mask, order=None):
+    """Positions of the rows selected by ``mask``, in ``order`` when sorting."""
+    if order is None:
+        return np.flatnonzero(mask)
+    return order[mask[order]]
+
+
+def page_slice(positions, page, page_size):
+    """Positions shown on 1-based ``page`` of ``page_size`` rows."""
+    start = (page - 1) * page_size
+    return positions[start:start + page_size]
+
+
+def column_summary(df):
+    """Count, missing values, distinct values and the usual statistics of every column."""
+    summary = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "non_null": df.notna().sum(),
+            "distinct": df.nunique(),
+        }
+    )
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        stats = numeric.astype(np.float64).agg(["sum", "mean", "std", "min", "median", "max"]).T
+        summary = summary.join(stats)
+    return summary